@@ -0,0 +1,269 @@
+#!/usr/bin/env python
+
+# Benchmarks of paperplot: synthetic data files shaped like the examples are
+# generated for every chart type and each figure is timed stage by stage
+# (parse, build, layout, save). Results are written as JSON, so that runs of
+# different commits can be compared:
+#
+#   python benchmarks/benchmark.py -o before.json
+#   python benchmarks/benchmark.py -o after.json --compare before.json
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import traceback
+import platform
+import tempfile
+import subprocess
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import paperplot as pp
+import matplotlib as mp
+
+STAGES = ('parse', 'build', 'layout', 'save')
+
+# size of every chart type in the examples folder:
+# rows     bar groups, stacked benchmarks, points of a line, points of a roofline application
+# series   bars per group, stacked segments, lines, roofline applications
+# clusters bars per stacked cluster
+# labels   labelled points per line, roofline compute ceilings
+CHARTS = {
+    'barchart'       : { 'rows' : 18, 'series' : 6 },
+    'clusterstacked' : { 'rows' : 19, 'series' : 8, 'clusters' : 3 },
+    'linechart'      : { 'rows' : 4, 'series' : 3, 'labels' : 4 },
+    'roofline'       : { 'rows' : 6, 'series' : 6, 'labels' : 6 },
+}
+
+
+def cycled(name, n, values=None):
+    # configuration line repeating the sequence `values` (the default value of
+    # option `name` if not given) to n entries
+    values = name if values is None else repr(values)
+    return "%s = [%s[i %% len(%s)] for i in range(%d)]\n" % (name, values, values, n)
+
+
+def write_files(folder, fname, rows, config, cei=None):
+    os.makedirs(folder)
+    with open(os.path.join(folder, fname + '.csv'), 'w') as f:
+        f.write('\n'.join(','.join(str(v) for v in row) for row in rows) + '\n')
+    with open(os.path.join(folder, 'local.config.py'), 'w') as f:
+        f.write(config)
+    if cei is not None:
+        with open(os.path.join(folder, fname + '.cei'), 'w') as f:
+            f.write('\n'.join(','.join(str(v) for v in row) for row in cei) + '\n')
+
+
+def gen_barchart(folder, rng, rows, series):
+    data = [[''] + ['S%d' % (j+1) for j in range(series)]]
+    for i in range(rows):
+        data.append(['bench%d' % i] + ['%.6f' % v for v in rng.uniform(0.5, 8., series)])
+    config = ('chart_type = "barchart"\nfigure_size = (20,6.5)\n'
+              "title = ''\nxtitle = ''\nytitle = 'Speed-up'\n"
+              'column_ids_data = list(range(1, %d))\ncolumn_ids_err = []\n'
+              'do_add_geomean = True\n' % (series+1))
+    config += cycled('colors', series+1) + cycled('hatch_patterns', series+1)
+    write_files(folder, 'barchart', data, config)
+
+
+def gen_clusterstacked(folder, rng, rows, series, clusters):
+    data = [['bench', 'type'] + ['S%d' % (j+1) for j in range(series)]]
+    for i in range(rows):
+        for c in range(clusters):
+            values = rng.dirichlet(np.ones(series)) * rng.uniform(0.8, 1.6)
+            data.append(['bench%d' % i, 'C%d' % c] + ['%.8f' % v for v in values])
+    config = ('chart_type = "clusterstacked"\nfigure_size = (20,6.5)\n'
+              "title = ''\nxtitle = ''\nytitle = 'Normalized execution time breakdown'\n"
+              'column_ids_data = list(range(2, %d))\ncolumn_ids_err = []\n'
+              'num_clustered = %d\nstacked = True\nlegend_loc = 9\nlegend_ncol = 4\n' % (series+2, clusters))
+    config += cycled('colors', series) + cycled('hatch_patterns', series)
+    write_files(folder, 'clusterstacked', data, config)
+
+
+def gen_linechart(folder, rng, rows, series, labels):
+    data = [['bench', 'label', 'x', 'y']]
+    for j in range(series):
+        x = np.cumsum(rng.uniform(1., 4., rows))
+        y = x * rng.uniform(0.5, 2.) + rng.uniform(0., 2., rows)
+        for i in range(rows):
+            data.append(['line%d' % j, 'p%d-%d' % (j, i) if i < labels else '', '%.4f' % x[i], '%.4f' % y[i]])
+    config = ('chart_type = "linechart"\nfigure_size = (10,10)\n'
+              "title = ''\nxtitle = ''\nytitle = 'Test'\nlegend_loc = 3\ndo_labels = True\n")
+    config += cycled('linecolors', series) + cycled('marker_patterns', series) + cycled('line_styles', series, ['-', '--', '-.', ':'])
+    write_files(folder, 'linechart', data, config)
+
+
+def gen_roofline(folder, rng, rows, series, labels):
+    data = [['App name', 'label', 'OI', 'gflopss']]
+    peak = 2.**(labels+4)
+    for j in range(series):
+        oi = 2.**rng.uniform(-4, 3)
+        attainable = min(oi*256., peak)
+        for i in range(rows):
+            data.append(['app%d' % j, 'v%d' % i, '%.6f' % (oi*(1+0.001*i)),
+                         '%.6f' % (attainable * (i+1) / float(rows+1))])
+    cei = [['', ''], [256, 173.95],
+           ['C%d' % k for k in range(labels)],
+           [peak / 2.**k for k in range(labels)]]
+    config = ('chart_type = "roofline"\nfigure_size = (12,8)\ntitle = "Roofline"\n'
+              'ytitle = "GFlop/s"\nxtitle = "Operational Intensity (Flop/Byte)"\n'
+              "xscale = 'log'\nyscale = 'log'\ndo_legend = True\nlegend_loc = 2\n"
+              'num_points = %d\n' % rows)
+    n = max(rows, labels) + 1
+    config += (cycled('linecolors', series) + cycled('line_styles', n, ['-', '--', '-.', ':']) +
+               cycled('marker_patterns', n) + cycled('marker_sizes', n) +
+               "mem_linecolors = ('k', 'red')\ncpu_linecolors = ['k'] * %d\n" % labels)
+    write_files(folder, 'roofline', data, config, cei)
+
+
+GENERATORS = {
+    'barchart'       : gen_barchart,
+    'clusterstacked' : gen_clusterstacked,
+    'linechart'      : gen_linechart,
+    'roofline'       : gen_roofline,
+}
+
+
+def time_figure(root, fname):
+    # seconds spent in every stage of rendering one figure, and the number of
+    # times the figure was drawn while laying it out and saving it
+    cfg = pp.resolve_config(root)
+    times = {}
+    with mp.rc_context():
+        mp.rc_file_defaults()
+        mp.rcParams.update(cfg.rc)
+        pp.set_tex_cache(cfg)
+
+        start = time.time()
+        ds, ceilings = pp.load_chart(root, fname, '.csv', cfg)
+        times['parse'] = time.time() - start
+
+        start = time.time()
+        fig, leg = pp.build_chart(fname, ds, ceilings, cfg)
+        times['build'] = time.time() - start
+        draws, cid = pp.count_draws(fig)
+        try:
+            start = time.time()
+            pp.layout_chart(fig, cfg)
+            times['layout'] = time.time() - start
+
+            start = time.time()
+            pp.save_chart(fig, leg, pp.output_files(root, fname, cfg), cfg)
+            times['save'] = time.time() - start
+        finally:
+            fig.canvas.mpl_disconnect(cid)
+            pp.release_figure(fig)
+    return times, draws[0]
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.STDOUT).decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(workdir, charts, sizes, repeat, usetex, seed=0):
+    if not usetex:
+        with open(os.path.join(workdir, 'local.config.py'), 'w') as f:
+            f.write("mp.rcParams['text.usetex'] = False\n")
+
+    # a chart type failing is reported without stopping the other ones
+    results, failed = [], []
+    for chart in charts:
+        params = dict((k, sizes.get(k) or v) for k, v in CHARTS[chart].items())
+        root = os.path.join(workdir, chart)
+        GENERATORS[chart](root, np.random.RandomState(seed), **params)
+
+        try:
+            runs, draws = zip(*[time_figure(root, chart) for r in range(repeat)])
+        except Exception:
+            print("%-15s FAILED\n%s" % (chart, traceback.format_exc()))
+            failed.append(chart)
+            continue
+        stages = {}
+        for stage in STAGES:
+            values = [run[stage] for run in runs]
+            stages[stage] = { 'min' : min(values), 'median' : float(np.median(values)) }
+        total = min(sum(run.values()) for run in runs)
+        results.append({ 'chart' : chart, 'params' : params, 'stages' : stages, 'total' : total,
+                         'draws' : max(draws) })
+        print("%-15s %-45s %s total %.3fs draws %d" % (chart, json.dumps(params, sort_keys=True),
+              ' '.join('%s %.3fs' % (s, stages[s]['min']) for s in STAGES), total, max(draws)))
+    return results, failed
+
+
+def compare(results, previous):
+    # per chart and stage: previous and current best time, and their ratio
+    old = dict((r['chart'] + json.dumps(r['params'], sort_keys=True), r) for r in previous['results'])
+    print("\nw.r.t. %s (%s):" % (previous.get('commit'), previous.get('date')))
+    for r in results:
+        o = old.get(r['chart'] + json.dumps(r['params'], sort_keys=True))
+        if o is None:
+            print("%-15s not in the previous results" % r['chart'])
+            continue
+        line = []
+        for stage in STAGES + ('total',):
+            new_t = r['total'] if stage == 'total' else r['stages'][stage]['min']
+            old_t = o['total'] if stage == 'total' else o['stages'][stage]['min']
+            line.append('%s %.2fx' % (stage, new_t / old_t if old_t else float('nan')))
+        if 'draws' in o:
+            line.append('draws %d -> %d' % (o['draws'], r['draws']))
+        print("%-15s %s" % (r['chart'], ' '.join(line)))
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Time paperplot on synthetic data, stage by stage.')
+    parser.add_argument('-o', '--output', default='benchmark.json', help='JSON file to write the results to')
+    parser.add_argument('--charts', default=','.join(sorted(CHARTS)), help='comma separated chart types to run')
+    parser.add_argument('--repeat', type=int, default=5, help='renders per figure, the best time is reported')
+    for dim in ('rows', 'series', 'clusters', 'labels'):
+        parser.add_argument('--' + dim, type=int, help='%s of every chart using them (see CHARTS)' % dim)
+    parser.add_argument('--no-usetex', dest='usetex', action='store_false', help='draw text without LaTeX')
+    parser.add_argument('--compare', help='JSON file of an earlier run to compare with')
+    parser.add_argument('--keep', action='store_true', help='keep the generated data files')
+    args = parser.parse_args()
+
+    charts = args.charts.split(',')
+    for chart in charts:
+        if chart not in CHARTS:
+            parser.error('unknown chart type %s' % chart)
+    sizes = dict((dim, getattr(args, dim)) for dim in ('rows', 'series', 'clusters', 'labels'))
+
+    workdir = tempfile.mkdtemp(prefix='paperplot-benchmark-')
+    try:
+        results, failed = run_benchmarks(workdir, charts, sizes, args.repeat, args.usetex)
+    finally:
+        if args.keep:
+            print("Data files kept in %s" % workdir)
+        else:
+            shutil.rmtree(workdir)
+
+    report = {
+        'paperplot'  : pp.__version__,
+        'commit'     : git_commit(),
+        'date'       : time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python'     : platform.python_version(),
+        'numpy'      : np.__version__,
+        'matplotlib' : mp.__version__,
+        'usetex'     : args.usetex,
+        'repeat'     : args.repeat,
+        'results'    : results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=1, sort_keys=True)
+    print("Results written to %s" % args.output)
+
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            compare(results, json.load(f))
+
+    if failed:
+        print("\nFailed: %s" % ', '.join(failed))
+        sys.exit(1)
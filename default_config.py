@@ -14,19 +14,66 @@ config_fname = "local.config.py"
 # figure size (x,y)
 figure_size = (5,4)
 
+# reuse a cleared figure between charts of the same figure size and figure.* rc settings (dpi, colors) instead of creating a new one
+reuse_figures = False
+
+# files written for every figure, all from a single layout of the figure:
+# 'pdf', 'svg', 'eps', 'png', or (format, dpi) for raster formats, e.g. ['pdf', ('png', 300)]
+output_formats = ['pdf']
+
+# margin (inches) kept around the drawn area, outputs are cropped to it
+crop_pad_inches = 0.02
+
+# layout of the figure, computed once before writing the outputs:
+# 'tight' (tight_layout), 'constrained' (constrained layout, also makes room
+# for legends and twin axes), None keeps the positions set by the chart
+layout_engine = 'tight'
+
+# Rasterize dense data layers in vector outputs: the lines, collections or patches
+# of an axes with more than rasterize_threshold points/shapes in total are drawn
+# as an image of rasterize_dpi, axes, texts and legends stay vector. None keeps all vector.
+rasterize_threshold = None      # e.g. 10000
+rasterize_dpi = 300
+
+# Grid mode: the data files of a folder are drawn as panels of a single figure
+# (figure_size is the size of the whole grid), in file name order, each by the
+# chart_type builder and with the same options, titles included
+grid = None             # (rows, cols), one may be None to fit all files, e.g. (None, 4); None: a figure per file
+grid_name = None        # file name of the grid figure, None uses the folder name
+grid_sharex = False     # share the x (y) axis between panels, tick labels only on the outer panels
+grid_sharey = False
+grid_legend = 'shared'  # 'shared' one legend above the grid (the first panel's), 'each' per panel, None
+
 # ID of the column that holds the xtick (horizontal) labels
 xticks_id = 0
 
 # Rotation for xticks labels
 xticks_rotation = 'horizontal'
 
+# Select, sort and extend the rows of the data file before plotting, column ids
+# below (column_ids_data, xticks_id...) refer to the columns after this step
+rowfilters = None   # keep rows by column value, e.g. { 'bench' : ['Deque', 'Btree'], 2 : [8, 16] }
+colfilters = None   # keep only these columns, e.g. ['bench', 'S1', 'S2']
+sortby = None       # column or list of columns to sort rows by, e.g. ['bench', 'type']
+newfields = None    # derived columns inserted after the first one, a value or a function of the data:
+                    # e.g. [ ('speedup', lambda ds: ds['base'] / ds['time']) ]
+
+# Aggregate repeated measurements, after newfields and before sortby: rows with equal
+# values in the aggregate_by columns become one row, in order of first appearance.
+# Numeric columns are reduced to their aggregate with an error, drawn as error bars;
+# other columns keep the value of the first row of each group.
+aggregate_by = None     # key columns, e.g. ['bench', 'type'], None disables aggregation
+aggregate = 'mean'      # 'mean' or 'median'
+aggregate_err = 'std'   # 'std' (sample stddev), 'sem' (standard error), 'ci95' (95% confidence interval), None
+
 # Column names
 auto_column_names = True                        # use column names from header row of CSV file
 column_names = ["First", "Second", "Third"]     # if auto_column_names is False specify column names here
 
 # ID of columns holding data and error data (for error bars)
 column_ids_data = [1, 2, 3]
-column_ids_err = [] # not implemented
+column_ids_err = [] # one per data column (linechart: one for y), empty uses the errors of aggregate_by
+errorbar_args = { 'capsize' : 3, 'elinewidth' : 1 }   # Axes.errorbar kwargs
 
 # titles and font sizes for figure, x and y axis
 title = "from-filename"
@@ -45,7 +92,8 @@ numbers_fontsize=16     # for numbers above ylim
 # Split for secondary axis
 line_split = None
 
-# y axes limit
+# axes limits
+xlim = None
 ylim = None
 ylim2 = None
 num_yticks = None
@@ -79,6 +127,11 @@ do_legend = True
 do_add_average = False
 do_add_geomean = False
 
+# summary rows (or series, for linecharts) added after the data, in this order
+# valid values 'average', 'geomean', 'median', 'harmonic'
+# None keeps the behaviour of do_add_average/do_add_geomean
+summaries = None
+
 # labels for bars that overflow ylim
 label_enable='no'                 # enable labels - valid values 'no', 'always', 'ylim'
 label_angle_rotation=0          # rotation angle
@@ -87,6 +140,11 @@ label_y_space=0                 # distance after ylim
 # relative possition to marker for text labels
 xytext_tomarker = (10, -10)
 
+# placement of data labels (linechart) and bar value labels (clusterstacked) so they do not overlap
+label_placement = 'grid'        # 'grid' built-in placement, 'adjust_text' (slow with many labels), None keeps labels in place
+label_placement_budget = 2.     # seconds spent placing labels per figure, labels left keep their position
+label_placement_rings = 4       # rings of candidate positions tried around each label
+
 # Allows modification of the figure bounding box in case some elements
 # like the legend get cut off of the figure.
 shrink_width_factor=1.
@@ -117,14 +175,31 @@ colors = [colorConverter.to_rgb(a) for a in (bw_palette_2).split()]
 # use palette_blue2+palette_blue15 for colored
 #colors = [colorConverter.to_rgb(a) for a in (palette_blue2 + palette_blue15).split()]
 
-# extensions allows for raw data files
-EXTENSIONS=['.csv']
+# extensions allows for raw data files, compressed files are decoded while they are read
+EXTENSIONS=['.csv', '.csv.gz', '.csv.bz2', '.csv.xz']
+
+# cache of parsed data files, stored as memory-mappable .npy files keyed by the file content
+parse_cache_dir = None          # folder of the cache, e.g. '/tmp/paperplot-cache', None disables it
+parse_cache_max_size = 1024     # MB, least recently used entries are evicted first
+parse_cache_max_age = 30        # days since last use
+
+# external tools run by --convert, as argument lists where {input} and {output}
+# are replaced by the file paths: .dia -> .eps, .svg -> .pdf, .eps -> .pdf, .pdf -> -crop.pdf
+convert_tools = {
+    'dia' : ['dia', '-e', '{output}', '-t', 'eps', '{input}'],
+    'svg' : ['inkscape', '{input}', '--export-text-to-path', '--export-pdf={output}', '--without-gui', '--export-area-drawing', '--vacuum-defs'],
+    'eps' : ['epstopdf', '{input}', '--outfile={output}'],
+    'pdf' : ['pdfcrop', '{input}', '{output}'],
+}
+
+# cache of the LaTeX typeset text (text.usetex), shared by all figures and workers
+tex_cache_dir = None            # folder of the cache, e.g. '~/.cache/paperplot-tex', None keeps matplotlib's own
 
 # paper formating - allow only type 1 core fonts
 mp.rcParams['ps.useafm'] = True
 mp.rcParams['pdf.use14corefonts'] = True
 mp.rcParams['text.usetex'] = True #Let TeX do the typsetting
-mp.rcParams['text.latex.preamble'] = [r'\usepackage{sansmath}', r'\sansmath'] #Force sans-serif math mode (for axes labels)
+mp.rcParams['text.latex.preamble'] = r'\usepackage{sansmath}\sansmath' #Force sans-serif math mode (for axes labels)
 mp.rcParams['font.family'] = 'sans-serif' # ... for regular text
 mp.rcParams['font.sans-serif'] = 'Helvetica, Avant Garde, Computer Modern Sans serif' # Choose a nice font here
 
@@ -192,6 +267,13 @@ do_labels = True
 do_x_as_xticks = False
 line_label_enable = False
 
+# Decimate series longer than downsample_points per inch of figure width before
+# plotting, so drawing time and file size stay bounded for very long traces:
+# None keeps every point, 'lttb' (largest triangle three buckets) keeps the
+# shape of the line, 'minmax' keeps the envelope (lowest and highest point of every bucket)
+downsample = None
+downsample_points = 200
+
 linecolors = [colorConverter.to_rgb(a) for a in (bw_palette_2).split()]
 
 
@@ -2,17 +2,63 @@
 
 import os
 import sys
-import string
 import numpy as np
 import matplotlib as mp
-import matplotlib.pyplot as plt
+# Figures are only ever written to files: select the non-interactive backend
+# before anything can import pyplot and probe for a GUI toolkit.
+mp.use('Agg')
 import csv
+import argparse
+import traceback
+import multiprocessing
+import subprocess
+import hashlib
+import json
+import copy
+import time
+import functools
 from math import log, atan2, degrees
-from matplotlib.colors import colorConverter
-from collections import OrderedDict
-from default_config import *
-from pprint import pprint
-from adjustText import adjust_text
+# matplotlib.figure (with the whole axes stack) and adjustText are imported when
+# the first figure is built, so that --help, argument errors and up to date
+# runs do not pay for them.
+
+__version__ = '0.2.0'
+
+# paperplot.py itself, its content is an input of every figure and of the
+# parse cache so that changes to the code are not hidden by the version
+SCRIPT = os.path.abspath(__file__)
+
+# name of the rebuild manifest kept in the folder given on the command line
+MANIFEST_FNAME = '.paperplot-manifest.json'
+
+# seconds spent in each stage of the figure being rendered, None unless
+# --timings is given; nested stages are not counted in the enclosing one
+_stage_times = None
+_open_stages = []
+
+# stages reported by --timings, in the order they run
+STAGES = ('config', 'parse', 'build', 'labels', 'layout', 'save')
+
+class timed(object):
+    # with timed('stage'): ... adds the time spent in the block to that stage
+    __slots__ = ('stage', 'start', 'nested')
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        if _stage_times is not None:
+            self.start, self.nested = time.time(), 0.
+            _open_stages.append(self)
+
+    def __exit__(self, *exc_info):
+        if _stage_times is not None:
+            elapsed = time.time() - self.start
+            _open_stages.pop()
+            if _open_stages:
+                _open_stages[-1].nested += elapsed
+            _stage_times[self.stage] = _stage_times.get(self.stage, 0.) + elapsed - self.nested
+
 
 def get_script_path():
     return os.path.dirname(os.path.realpath(sys.argv[0]))
@@ -25,72 +71,418 @@ def print_usage(caller):
     A number of use cases are provided in the `examples` folder. To test the script and generate the plots run:
 
         python %(a)s examples/%(c)s
+
+    Options:
+
+        -j N, --jobs N      render figures in N worker processes (0 uses one per core)
+        -f, --force         render every figure, even if its inputs did not change
+        -w, --watch         keep running and re-render figures whenever their inputs change
+        --watch-interval S  poll the folder every S seconds in watch mode (default 0.5)
+        --tex-preflight     typeset the LaTeX text of all figures up front, in parallel
+        --convert           instead of rendering figures, convert .dia, .svg and .eps
+                            files to PDF and crop PDFs, with the tools in convert_tools
+        --timings           report the time of every stage and the slowest figures
+        --profile DIR       write a cProfile file per figure into DIR
     """ % { 'a' : caller.split('/')[-1] , 'c' : caller.split('/')[-1].split('.')[0] }
     print(USAGE)
 
 
-def row_data_process(r):
-    return r
+class Dataset(object):
+    # Columnar view of a data file: one NumPy array per column, in header order.
+    # Columns taken from a recarray are views on it, no data is copied.
+    # Aggregated columns also have an error (e.g. stddev) per row, None otherwise.
 
+    def __init__(self, names, columns, errors=None):
+        self.names = list(names)
+        self.columns = list(columns)
+        self.errors = list(errors) if errors is not None else [None] * len(self.columns)
 
-def select_results(ra, rowfilters = None, colfilters = None, sortby = None, newfield = None):
-    # apply rowfilter dictionary
-    for k,v in rowfilters.items():
-        filter_idx = [i for i,s in enumerate(ra[k]) if s in v]
-        ra = ra[filter_idx]
+    @classmethod
+    def from_recarray(cls, ra):
+        return cls(ra.dtype.names, [np.asarray(ra[n]) for n in ra.dtype.names])
 
-    # apply colfilters list
-    if colfilters:
-        ra = ra[colfilters]
-
-    # add a new field (column) in the recarray
-    if newfield:
-        new_desc = ra.dtype.descr
-        new_desc.insert(1, ('newfield', type(newfield))) # insert dtype in position 1
-        y = np.empty(ra.shape, dtype=new_desc)
-        for name in ra.dtype.names:
-            y[name] = ra[name]
-        y['newfield'] = [newfield] * ra.size
-        ra = y
-
-    # sortby
-    if sortby:
-        # for s in sortby:
-        ra.sort(order=sortby)
+    def __len__(self):
+        return len(self.columns[0]) if self.columns else 0
 
-    return ra
+    def __getitem__(self, key):
+        # columns are addressed by position (as the column ids of the config) or by name
+        if isinstance(key, str):
+            key = self.names.index(key)
+        return self.columns[key]
 
+    def error(self, key):
+        if isinstance(key, str):
+            key = self.names.index(key)
+        return self.errors[key]
 
-def parse_recarray(ra):
-    # parse final recarray to obtain header and data objects
+    def rows(self, index):
+        # subset of rows, slices give views while masks and index arrays copy the selected rows only
+        return Dataset(self.names, [c[index] for c in self.columns],
+                       [e if e is None else e[index] for e in self.errors])
 
-    d2 = []
-    header = []
-    for d in ra:
-        d2.append(row_data_process(d))
-    for n in ra.dtype.names:
-        header.append(row_data_process(n))
 
-    return d2, header
+def select_results(ds, rowfilters = None, colfilters = None, sortby = None, newfields = None,
+                   aggregate_by = None, aggregate = 'mean', aggregate_err = 'std'):
+    # apply rowfilter dictionary, one boolean mask over all keys
+    if rowfilters:
+        keep = np.ones(len(ds), dtype=bool)
+        for k,v in rowfilters.items():
+            keep &= np.isin(ds[k], list(v))
+        ds = ds.rows(keep)
 
+    # apply colfilters list, columns given by position keep their header name
+    if colfilters:
+        ds = Dataset([c if isinstance(c, str) else ds.names[c] for c in colfilters],
+                     [ds[c] for c in colfilters])
+
+    # add new fields (columns) after the first one, existing columns are not copied
+    if newfields:
+        names = list(ds.names)
+        columns = list(ds.columns)
+        for i,(name, value) in enumerate(newfields):
+            if callable(value):
+                column = np.asarray(value(ds))
+            else:
+                column = np.repeat(value, len(ds))
+            names.insert(i+1, name)
+            columns.insert(i+1, column)
+        ds = Dataset(names, columns)
+
+    # one row per distinct key, repeated measurements reduced with their error
+    if aggregate_by:
+        if not isinstance(aggregate_by, (list, tuple)):
+            aggregate_by = [aggregate_by]
+        ds = aggregate_rows(ds, aggregate_by, aggregate, aggregate_err)
+
+    # sortby, stable so rows with equal keys keep their order
+    if sortby:
+        if not isinstance(sortby, (list, tuple)):
+            sortby = [sortby]
+        ds = ds.rows(np.lexsort([ds[k] for k in reversed(sortby)]))
+
+    return ds
+
+
+# two-sided 95% quantiles of Student's t distribution by degrees of freedom,
+# interpolated linearly in 1/df in between
+T95 = [(1, 12.706), (2, 4.303), (3, 3.182), (4, 2.776), (5, 2.571), (6, 2.447),
+       (7, 2.365), (8, 2.306), (9, 2.262), (10, 2.228), (12, 2.179), (15, 2.131),
+       (20, 2.086), (25, 2.060), (30, 2.042), (40, 2.021), (60, 2.000), (120, 1.980)]
+
+def t95(df):
+    df = np.asarray(df, dtype=float)
+    inv = [1.0 / d for d, t in reversed(T95)]
+    ts = [t for d, t in reversed(T95)]
+    # beyond the table the normal quantile, 1/df = 0
+    with np.errstate(divide='ignore'):
+        return np.interp(1.0 / df, [0.0] + inv, [1.960] + ts)
+
+
+def group_keys(ds, by):
+    # group index of every row for the key columns by, groups numbered in order
+    # of first appearance, and the first row of each group
+    codes = np.column_stack([np.unique(ds[k], return_inverse=True)[1].ravel() for k in by])
+    keys, first, inverse = np.unique(codes, axis=0, return_index=True, return_inverse=True)
+    rank = np.empty(len(keys), dtype=np.intp)
+    rank[np.argsort(first)] = np.arange(len(keys))
+    return rank[inverse.ravel()], np.sort(first)
+
+
+def aggregate_rows(ds, by, how='mean', err='std'):
+    # Reduce rows with equal values in the key columns by to a single row. Numeric
+    # columns become their mean or median over the group, with the sample stddev,
+    # standard error (sem) or 95% confidence interval half-width (ci95) as error;
+    # other columns keep the value of the first row of the group.
+    if how not in ('mean', 'median'):
+        raise ValueError("Unknown aggregate: %s" % how)
+    if err not in ('std', 'sem', 'ci95', None):
+        raise ValueError("Unknown aggregate_err: %s" % err)
+    keys = set(ds.names.index(k) if isinstance(k, str) else k for k in by)
+    group, first = group_keys(ds, by)
+    counts = np.bincount(group).astype(float)
+
+    columns, errors = [], []
+    for i, column in enumerate(ds.columns):
+        if i in keys or column.dtype.kind not in 'biuf':
+            columns.append(column[first])
+            errors.append(None)
+            continue
+        values = column.astype(float)
+        mean = np.bincount(group, weights=values) / counts
+        if how == 'mean':
+            center = mean
+        else:
+            # sort by group then value, the median is the middle of every group
+            ordered = values[np.lexsort((values, group))]
+            start = np.concatenate(([0], np.cumsum(counts[:-1]))).astype(np.intp)
+            n = counts.astype(np.intp)
+            center = (ordered[start + (n-1)//2] + ordered[start + n//2]) / 2.
+        columns.append(center)
+
+        if err is None:
+            errors.append(None)
+            continue
+        with np.errstate(divide='ignore', invalid='ignore'):
+            std = np.sqrt(np.bincount(group, weights=(values - mean[group])**2) / (counts - 1))
+        std[counts < 2] = 0. # a single measurement has no spread
+        if err == 'sem':
+            std /= np.sqrt(counts)
+        elif err == 'ci95':
+            std *= t95(np.maximum(counts - 1, 1)) / np.sqrt(counts)
+        errors.append(std)
+    return Dataset(ds.names, columns, errors)
+
+
+def unique_in_order(column):
+    # distinct values of a column in order of first appearance
+    values, first = np.unique(column, return_index=True)
+    return list(column[np.sort(first)])
+
+
+def row_filter(headers, rowfilters):
+    # predicate on raw CSV rows for the rowfilters that can be checked before parsing;
+    # it only drops rows that select_results would drop as well
+    tests = []
+    for k,v in rowfilters.items():
+        if isinstance(k, int):
+            idx = k
+        elif k in headers:
+            idx = headers.index(k)
+        else:
+            continue
+        if not all(isinstance(a, (str, int, float)) and not isinstance(a, bool) for a in v):
+            continue
+        strings = set(str(a) for a in v)
+        numbers = set(float(a) for a in v if not isinstance(a, str))
+        tests.append((idx, strings, numbers))
+
+    def keep(row):
+        for idx, strings, numbers in tests:
+            value = row[idx]
+            if value in strings:
+                continue
+            try:
+                if float(value) in numbers:
+                    continue
+            except ValueError:
+                pass
+            return False
+        return True
+    return keep
+
+
+def group_rows(column):
+    # split the rows by the values of a column with one stable sort: returns the
+    # values in order of first appearance and, for each, its row indices in order
+    values, first, inverse = np.unique(column, return_index=True, return_inverse=True)
+    rank = np.empty(len(values), dtype=np.intp)
+    rank[np.argsort(first)] = np.arange(len(values))
+    group = rank[inverse.ravel()]
+    rows = np.argsort(group, kind='mergesort')
+    bounds = np.cumsum(np.bincount(group, minlength=len(values)))[:-1]
+    return list(column[np.sort(first)]), np.split(rows, bounds)
+
+
+# rows of a data file parsed at a time, bounds the text held in memory
+CSV_CHUNK_ROWS = 1 << 14
+
+# decompressors of data files by extension, from the standard library
+CODECS = {
+    '.gz'  : ('gzip', 'open'),
+    '.bz2' : ('bz2', 'BZ2File'),
+    '.xz'  : ('lzma', 'open'),
+}
+
+
+def open_data(filename):
+    # text stream of a data file, compressed files are decoded on the fly
+    ext = os.path.splitext(filename)[1].lower()
+    if ext not in CODECS:
+        return open(filename, 'r')
+    module, opener = CODECS[ext]
+    f = getattr(__import__(module), opener)(filename, 'rb')
+    if sys.version_info[0] < 3:
+        return f
+    import io
+    return io.TextIOWrapper(f, newline='')
+
+
+def convert_column(values, kind):
+    # array of strings to int, float (empty values are nan) or kept as strings
+    if kind is str:
+        return values
+    if kind is float:
+        values = np.where(values == '', 'nan', values)
+    return values.astype(kind)
+
+
+def guess_column(values):
+    # (type, converted array) of an array of strings, the narrowest type that fits
+    for kind in (int, float):
+        try:
+            return kind, convert_column(values, kind)
+        except (ValueError, OverflowError):
+            pass
+    return str, values
+
+
+def read_csv(filename, rowfilters=None):
+    # Read a csv file (or .gz, .bz2, .xz compressed one) in a single pass and
+    # return a recarray with the header row as column names. Rows are parsed in
+    # chunks of CSV_CHUNK_ROWS into typed column arrays, so neither the whole
+    # text nor a decompressed copy of the file is ever kept. Column types are
+    # guessed from the first chunk; a column turning out to hold text further
+    # down is read again as strings.
+    kinds = {}
+    result = None
+    while result is None:
+        result = parse_csv(filename, rowfilters, kinds)
+    headers, chunks = result
+    if not chunks[0]:
+        if rowfilters:
+            raise ValueError("No rows of %s left after applying rowfilters" % filename)
+        raise ValueError("No rows in %s" % filename)
+    # columns without a header are named f<index>, as numpy did for csv2rec
+    names = [h if h else 'f%d' % j for j, h in enumerate(headers)]
+    return np.rec.fromarrays([np.concatenate(c) for c in chunks], names=names)
+
+
+def parse_csv(filename, rowfilters, kinds):
+    # (headers, list of array chunks per column) of a data file, or None when a
+    # column guessed as numbers holds text: kinds (column index -> type) is
+    # updated and the file has to be parsed again
+    with open_data(filename) as f:
+        reader = csv.reader(f)
+        headers = next(reader)
+        # filter pushdown: rows dropped by rowfilters are never type converted
+        keep = row_filter(headers, rowfilters) if rowfilters else None
+        chunks = [[] for h in headers]
+        rows = []
+        for row in reader:
+            if not row:
+                continue
+            if len(row) != len(headers):
+                raise ValueError("Line %d of %s has %d fields, expected %d" %
+                                 (reader.line_num, filename, len(row), len(headers)))
+            if keep and not keep(row):
+                continue
+            rows.append(row)
+            if len(rows) == CSV_CHUNK_ROWS:
+                if not add_chunk(rows, chunks, kinds):
+                    return None
+                rows = []
+        if rows and not add_chunk(rows, chunks, kinds):
+            return None
+    return headers, chunks
+
+
+def add_chunk(rows, chunks, kinds):
+    # append the columns of rows to chunks, False if a column has to be read as text
+    for j, values in enumerate(zip(*rows)):
+        values = np.array(values, dtype=str)
+        if j not in kinds:
+            kinds[j], values = guess_column(values)
+            chunks[j].append(values)
+            continue
+        try:
+            chunks[j].append(convert_column(values, kinds[j]))
+        except (ValueError, OverflowError):
+            kind, values = guess_column(values)
+            if kinds[j] is not int or kind is not float:
+                kinds[j] = str
+                return False
+            # ints followed by floats: earlier chunks are converted, not parsed again
+            kinds[j] = float
+            chunks[j] = [c.astype(float) for c in chunks[j]] + [values]
+    return True
+
+
+def load_csv(filename, cfg):
+    # parse a data file, going through the parse cache if enabled; the cache
+    # holds whole files, rowfilters are then applied on the cached arrays
+    if not cfg.parse_cache_dir:
+        return read_csv(filename, cfg.rowfilters)
+
+    key = hashlib.sha1(('%s:%s:%s' % (__version__, file_hash(SCRIPT), file_hash(filename))).encode('utf-8')).hexdigest()
+    cached = os.path.join(cfg.parse_cache_dir, key + '.npy')
+    if os.path.isfile(cached):
+        try:
+            ra = np.load(cached, mmap_mode='r')
+            os.utime(cached, None) # mark as recently used
+            return ra.view(np.recarray)
+        except (IOError, OSError, ValueError):
+            pass
+
+    ra = read_csv(filename)
+    # python objects (e.g. dates) can not be memory mapped, do not cache those
+    if not ra.dtype.hasobject:
+        try:
+            if not os.path.isdir(cfg.parse_cache_dir):
+                os.makedirs(cfg.parse_cache_dir)
+            tmp = '%s.%d.tmp' % (cached, os.getpid())
+            with open(tmp, 'wb') as f:
+                np.save(f, ra.view(np.ndarray))
+            os.rename(tmp, cached)
+            evict_parse_cache(cfg)
+        except (IOError, OSError):
+            pass
+    return ra
 
-def get_data(data, column_ids_data, column_ids_err):
-    # populate columns data
-    columns_data = []
-    for i in column_ids_data:
-        t = [a[i] for a in data]
-        columns_data.append(t)
 
-    columns_errdata = []
-    for i in column_ids_err:
-        t = [a[i] for a in data]
-        columns_errdata.append(t)
+def evict_parse_cache(cfg):
+    # drop entries unused for parse_cache_max_age days, then the least recently
+    # used ones until the cache fits in parse_cache_max_size
+    now = time.time()
+    entries = []
+    for f in os.listdir(cfg.parse_cache_dir):
+        if not f.endswith('.npy'):
+            continue
+        path = os.path.join(cfg.parse_cache_dir, f)
+        try:
+            st = os.stat(path)
+            if now - st.st_mtime > cfg.parse_cache_max_age * 86400:
+                os.remove(path)
+            else:
+                entries.append((st.st_mtime, st.st_size, path))
+        except OSError: # removed by another worker
+            pass
+
+    total = sum(size for mtime, size, path in entries)
+    for mtime, size, path in sorted(entries):
+        if total <= cfg.parse_cache_max_size * 2**20:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        total -= size
+
+
+def get_data(ds, column_ids_data, column_ids_err):
+    # populate columns data, views on the dataset columns; errors are the
+    # column_ids_err columns, or else the errors of aggregated data columns
+    columns_data = [ds[i] for i in column_ids_data]
+    if column_ids_err:
+        columns_errdata = [ds[i] for i in column_ids_err]
+    else:
+        columns_errdata = [ds.error(i) for i in column_ids_data]
+        if all(e is None for e in columns_errdata):
+            columns_errdata = []
+        else:
+            columns_errdata = [np.zeros(len(ds)) if e is None else e for e in columns_errdata]
 
     return columns_data, columns_errdata
 
 
+def draw_errorbars(ax, x, y, yerr, cfg, color='black'):
+    # error bars alone, no markers nor line, at (x, y)
+    if yerr is None:
+        return None
+    return ax.errorbar(x, y, yerr=yerr, fmt='none', ecolor=color, **cfg.errorbar_args)
+
+
 def set_titles(ax, title, xtitle, ytitle, title_fontsize,
-                xtitle_fontsize, ytitle_fontsize, ylabel_fontsize):
+                xtitle_fontsize, ytitle_fontsize, ylabel_fontsize, xlabel_fontsize):
     ax.set_title(title, fontsize=title_fontsize)
     ax.set_xlabel(xtitle, fontsize=xtitle_fontsize)
     ax.set_ylabel(ytitle, fontsize=ytitle_fontsize)
@@ -100,88 +492,309 @@ def set_titles(ax, title, xtitle, ytitle, title_fontsize,
         item.set_fontsize(xlabel_fontsize)
 
 
-def add_average(data, errdata, names):
-    for col in data:
-        col.append(sum(col)/float(len(col)))
-
-    for col in errdata:
-        col.append(sum(col)/float(len(col)))
-
-    names.append('Average')
-    return data, errdata, names
-
-
-def add_geomean(data, errdata, names):
-    for col in data:
-        col.append(reduce(lambda x, y: x*y, col)**(1.0/len(col)))
-
-    for col in errdata:
-        col.append(reduce(lambda x, y: x*y, col)**(1.0/len(col)))
-
-    names.append('Geomean')
-    return data, errdata, names
-
-def frange(start, stop, step=1.0):
-    f = start
-    while f < stop:
-        f += step
-        yield f
-
-def mk_clusterstacked(title, ra):
-    # convert ra into header and data objects
-    if line_split:
-        alldata, header = parse_recarray(ra[:line_split])
-        alldata2, header2 = parse_recarray(ra[line_split:])
-    else:
-        alldata, header = parse_recarray(ra)
+# labels of the summary rows
+SUMMARY_NAMES = { 'average' : 'Average', 'geomean' : 'Geomean', 'median' : 'Median', 'harmonic' : 'Harmean' }
+
+def get_summaries(cfg):
+    if cfg.summaries is not None:
+        return list(cfg.summaries)
+    if cfg.do_add_average:
+        return ['average']
+    elif cfg.do_add_geomean:
+        return ['geomean']
+    return []
+
+
+def summarize(values, how, axis=0):
+    # reduce values along axis, geomean is computed in the log domain so long
+    # columns neither overflow nor underflow
+    values = np.asarray(values, dtype=float)
+    with np.errstate(divide='ignore'):
+        if how == 'average':
+            return values.mean(axis=axis)
+        elif how == 'geomean':
+            return np.exp(np.log(values).mean(axis=axis))
+        elif how == 'median':
+            return np.median(values, axis=axis)
+        elif how == 'harmonic':
+            return 1.0 / (1.0 / values).mean(axis=axis)
+    raise ValueError("Unknown summary: %s" % how)
+
+
+def add_summaries(data, errdata, names, summaries, num_clustered=1):
+    # append one summary row per reduction to every column; with num_clustered > 1
+    # rows are clusters of num_clustered bars and every slot of the cluster is reduced separately
+    if not summaries:
+        return data, errdata, names
+
+    def extend(columns, reduce=True):
+        if not columns:
+            return columns
+        table = np.array(columns, dtype=float)
+        slots = table.reshape(len(columns), -1, num_clustered) # view, one row per cluster
+        rows = [summarize(slots, how, axis=1) if reduce else np.full(slots[:, 0].shape, np.nan)
+                for how in summaries]
+        return list(np.concatenate([table] + rows, axis=1))
+
+    # summaries of errors are not the errors of summaries: no error bar on those rows
+    names = list(names) + [SUMMARY_NAMES[how] for how in summaries]
+    return extend(data), extend(errdata, reduce=False), names
+
+
+def lttb_indices(x, y, points):
+    # Largest triangle three buckets: the first and last points, and one point
+    # per bucket in between, the one forming the largest triangle with the point
+    # kept in the previous bucket and the mean of the next bucket.
+    edges = np.linspace(1, len(x) - 1, points - 1).astype(np.intp)
+    counts = np.diff(edges)
+    mean_x = np.add.reduceat(x[:edges[-1]], edges[:-1]) / counts
+    mean_y = np.add.reduceat(y[:edges[-1]], edges[:-1]) / counts
+    mean_x, mean_y = np.append(mean_x[1:], x[-1]), np.append(mean_y[1:], y[-1])
+
+    keep = np.empty(points, dtype=np.intp)
+    keep[0], keep[-1] = 0, len(x) - 1
+    a = 0
+    for b in range(points - 2):
+        lo, hi = edges[b], edges[b+1]
+        area = np.abs((x[a] - mean_x[b]) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (mean_y[b] - y[a]))
+        a = lo + np.argmax(np.where(np.isnan(area), -1., area))
+        keep[b+1] = a
+    return keep
+
+
+def minmax_indices(x, y, points):
+    # min/max envelope: the first and last points and, in each bucket, the
+    # points with the lowest and highest values
+    edges = np.linspace(0, len(y), points // 2 + 1).astype(np.intp)[:-1]
+    counts = np.diff(np.append(edges, len(y)))
+    bucket = np.repeat(np.arange(len(edges)), counts)
+    keep = [np.array([0, len(y) - 1])]
+    for reduce in (np.fmin, np.fmax):
+        extreme = np.flatnonzero(y == np.repeat(reduce.reduceat(y, edges), counts))
+        # first extreme point of every bucket
+        keep.append(extreme[np.unique(bucket[extreme], return_index=True)[1]])
+    return np.unique(np.concatenate(keep))
+
+
+def downsample(x, y, points, how):
+    # indices of the points of a series kept when decimating it to about
+    # `points` points with method `how` ('lttb' or 'minmax'), None to keep all;
+    # at least the first and last points and one bucket in between are kept
+    points = max(points, 3)
+    if how is None or len(y) <= points:
+        return None
+    x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+    if how == 'lttb':
+        return lttb_indices(x, y, points)
+    elif how == 'minmax':
+        return minmax_indices(x, y, points)
+    raise ValueError("Wrong downsample method: %s" % how)
+
+
+# figures kept between jobs when reuse_figures is set, by figure size and rc settings
+_figures = {}
+
+# rc settings a Figure takes when it is created, reused figures must share them
+FIGURE_RC = ('figure.dpi', 'figure.facecolor', 'figure.edgecolor', 'figure.frameon',
+             'figure.autolayout', 'figure.constrained_layout.use')
+
+def new_figure(cfg):
+    # Figures are not registered with pyplot, they belong to the job drawing
+    # them and are freed with it. With reuse_figures a cleared figure of the
+    # same size and FIGURE_RC settings (and its canvas and renderer) is handed
+    # out again instead.
+    figsize = tuple(cfg.figure_size)
+    key = (figsize,) + tuple(mp.rcParams[k] for k in FIGURE_RC)
+    if cfg.reuse_figures and key in _figures:
+        fig = _figures[key]
+        fig.clf()
+        fig.pending_labels = []
+        fig.subplots_adjust(**dict((k, mp.rcParams['figure.subplot.' + k])
+                                   for k in ('left', 'right', 'bottom', 'top', 'wspace', 'hspace')))
+        return fig
+
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    fig = Figure(figsize=figsize)
+    FigureCanvasAgg(fig)
+    if cfg.reuse_figures:
+        _figures[key] = fig
+    return fig
+
+
+def release_figure(fig):
+    # drop all artists right after saving, so memory does not pile up until garbage collection
+    fig.clf()
+    fig.pending_labels = []
+
+
+def get_renderer(fig):
+    if hasattr(fig.canvas, 'get_renderer'):
+        return fig.canvas.get_renderer()
+    from matplotlib import tight_layout
+    return tight_layout.get_renderer(fig)
+
+
+# candidate directions tried around a label, in order of preference
+PLACEMENT_DIRECTIONS = ((0, 1), (1, 0), (0, -1), (-1, 0), (1, 1), (-1, 1), (1, -1), (-1, -1))
+
+def place_labels(ax, texts, cfg, lines=()):
+    # Queue texts to be moved clear of each other and of the markers of lines.
+    # They are placed by layout_chart, once the view limits are autoscaled and
+    # the axes laid out: display coordinates measured before are stale.
+    if texts and cfg.label_placement:
+        if not hasattr(ax.figure, 'pending_labels'):
+            ax.figure.pending_labels = []
+        ax.figure.pending_labels.append((ax, texts, cfg, lines))
+
+
+def place_pending_labels(fig):
+    pending, fig.pending_labels = getattr(fig, 'pending_labels', []), []
+    if not pending:
+        return
+    # reading the limits autoscales every axes the texts or markers belong to
+    for ax in fig.axes:
+        ax.get_xlim(), ax.get_ylim()
+    with timed('labels'):
+        for ax, texts, cfg, lines in pending:
+            points = [line.get_transform().transform(line.get_xydata()) for line in lines]
+            move_labels(ax, texts, cfg, np.concatenate(points) if points else None)
+
+
+def move_labels(ax, texts, cfg, points=None):
+    # Move texts so they overlap neither each other nor the markers at points
+    # (display coordinates). Placed boxes are kept in a uniform grid, so every
+    # candidate position is only checked against the boxes of nearby cells.
+    # Candidates are tried ring by ring around the original position; when no
+    # free one is found the least overlapping candidate is kept. Once
+    # label_placement_budget seconds are spent remaining texts stay in place.
+    if cfg.label_placement == 'adjust_text':
+        from adjustText import adjust_text
+        adjust_text(texts, ax=ax)
+        return
+
+    renderer = get_renderer(ax.figure)
+    extents = [t.get_window_extent(renderer) for t in texts]
+    gap = renderer.points_to_pixels(1.)  # kept between a moved label and the box it was moved off
+    cell = max(1., np.median([max(e.width, e.height) for e in extents]))
+    grid = {}
+    boxes = []
+
+    def cells(box):
+        x0, y0, x1, y1 = box
+        for i in range(int(x0 // cell), int(x1 // cell) + 1):
+            for j in range(int(y0 // cell), int(y1 // cell) + 1):
+                yield i, j
+
+    def add(box):
+        boxes.append(box)
+        for c in cells(box):
+            grid.setdefault(c, []).append(len(boxes) - 1)
+
+    def overlaps(box):
+        x0, y0, x1, y1 = box
+        found = set()
+        for c in cells(box):
+            for k in grid.get(c, ()):
+                b = boxes[k]
+                if b[0] < x1 and x0 < b[2] and b[1] < y1 and y0 < b[3]:
+                    found.add(k)
+        return len(found)
+
+    # markers are obstacles too
+    if points is not None:
+        size = cell / 4.
+        for px, py in points:
+            add((px - size, py - size, px + size, py + size))
+
+    start = time.time()
+    for t, e in zip(texts, extents):
+        if time.time() - start > cfg.label_placement_budget:
+            break
+        best, best_overlaps = (0., 0.), None
+        for ring in range(cfg.label_placement_rings + 1):
+            for dx, dy in (PLACEMENT_DIRECTIONS if ring else ((0, 0),)):
+                shift = (dx * ring * (e.width / 2. + gap), dy * ring * (e.height + gap))
+                n = overlaps((e.x0 + shift[0], e.y0 + shift[1], e.x1 + shift[0], e.y1 + shift[1]))
+                if best_overlaps is None or n < best_overlaps:
+                    best, best_overlaps = shift, n
+                if not n:
+                    break
+            if not best_overlaps:
+                break
+        add((e.x0 + best[0], e.y0 + best[1], e.x1 + best[0], e.y1 + best[1]))
+        if best != (0., 0.):
+            transform = t.get_transform()
+            x, y = transform.transform(t.get_position())
+            t.set_position(transform.inverted().transform((x + best[0], y + best[1])))
+
+
+def draw_bars(ax, left, height, width, bottom=0, color=None, hatch=None):
+    # Draw bars sharing color and hatch as a single collection instead of one
+    # Rectangle artist per bar, left is the left edge of each bar. Returns a
+    # rectangle with the same style to be used as legend handle.
+    from matplotlib.collections import PolyCollection
+    from matplotlib.patches import Rectangle
+    left, height, width, bottom = np.broadcast_arrays(*[np.asarray(a, dtype=float) for a in (left, height, width, bottom)])
+    right, top = left+width, bottom+height
+    verts = np.stack([np.column_stack(p) for p in ((left, bottom), (left, top), (right, top), (right, bottom))], axis=1)
+
+    bars = PolyCollection(verts, facecolors=[color], edgecolors='black', hatch=hatch, alpha=1)
+    bars.sticky_edges.y.append(0) # as ax.bar, no margin below the bars
+    ax.add_collection(bars)
+    ax.autoscale_view()
+    return Rectangle((0, 0), 1, 1, facecolor=color, edgecolor='black', hatch=hatch, alpha=1)
+
+
+def mk_clusterstacked(title, ds, cfg, ax=None):
+    # rows from line_split on go to the secondary axis
+    if cfg.line_split:
+        ds2 = ds.rows(slice(cfg.line_split, None))
+        ds = ds.rows(slice(None, cfg.line_split))
+    header = ds.names
 
     # labels, use benchmark names untill line_split
-    xticks = list(OrderedDict.fromkeys([a[xticks_id] for a in alldata]))
+    xticks = unique_in_order(ds[cfg.xticks_id])
 
     # get additional xticks_per_bar untill line_split
-    xticks_per_bar = [a[xticks_per_bar_id] for a in alldata]
+    xticks_per_bar = ds[cfg.xticks_per_bar_id]
 
     # column names
-    if auto_column_names:
+    legend = list(cfg.column_names)
+    column_ids_data = cfg.column_ids_data
+    if cfg.auto_column_names:
         legend = header[2:]
         column_ids_data = range(2, len(legend)+2)
 
     # get data from specified columns
-    data, data_err = get_data(alldata, column_ids_data, column_ids_err)
-
-    # Add arithmetic and/or geometric means
-    if do_add_average:
-        xticks.append("Average")
-        for idx,d in enumerate(data):
-            for i in xrange(num_clustered):
-                dd = d[i::num_clustered]
-                d.append(sum(dd)/len(dd))
+    data, data_err = get_data(ds, column_ids_data, cfg.column_ids_err)
 
-    if do_add_geomean:
-        print('Warning GEOMEAN not implemented for cluster stacked plots')
-        #columns_data, columns_errdata, xtick_labels = add_geomean(columns_data, columns_errdata, xtick_labels)
+    # Add summary rows, per cluster slot
+    data, data_err, xticks = add_summaries(data, data_err, xticks, get_summaries(cfg), cfg.num_clustered)
 
     assert(len(legend)==len(data))
     ind = np.arange(len(xticks))                # the x locations for the groups
-    barwidth = (1.0/float(num_clustered+0.5))     # the width of the bars
+    barwidth = (1.0/float(cfg.num_clustered+0.5))     # the width of the bars
     one_barwidth = (barwidth/len(data))*0.8       # the width of one bar if not staked
 
-    # create a new figure and axes instance
-    fig = plt.figure(figsize=figure_size) # figure size specified in config
-    ax = fig.add_subplot(111)
+    # create a new figure and axes instance, unless drawing a panel of a grid
+    if ax is None:
+        fig = new_figure(cfg) # figure size specified in config
+        ax = fig.add_subplot(111)
+    fig = ax.figure
 
     # Draw horizontal lines
-    for line in hlines:
+    for line in cfg.hlines:
         ax.axhline(line,color="grey",zorder=0)
 
     # Set ylim and xlim
-    if ylim:
-        ax.set_ylim(*ylim)
+    if cfg.ylim:
+        ax.set_ylim(*cfg.ylim)
     ax.set_xlim(right=len(ind))
 
     # Set axis scales
-    ax.set_yscale(yscale)
-    ax.set_xscale(xscale)
+    ax.set_yscale(cfg.yscale)
+    ax.set_xscale(cfg.xscale)
 
     # calculate bottoms for stacking
     y = np.row_stack(data)
@@ -189,99 +802,90 @@ def mk_clusterstacked(title, ra):
     # is necessary to avoid having to manually order the datasets
     y_stack = np.cumsum(y, axis=0)
 
-    # add bars to be printed
+    # add bars to be printed, one collection per breakdown component
     rects = []
     left_empty = barwidth/2.0
-    if stacked: # Draw the bars staked
-        for idx,d in enumerate(data):
-            for i in xrange(num_clustered):
-                # this gives every n'th element given a starting position 'i'
-                # will give the values for a certain configuration for one breakdown component
-                dd = d[i::num_clustered]
-
-                # calculate bottoms
-                if idx == 0:
-                    bb = [0] * len(dd)
-                else:
-                    b = y_stack[idx-1]
-                    bb = b[i::num_clustered]
-                assert(len(ind)==len(dd)==len(bb))
-                rects.append(ax.bar(left=left_empty+ind+(i*barwidth), height=dd, width=barwidth, bottom=bb,
-                                alpha=1, color=colors[idx], ecolor='black', edgecolor='black', hatch=hatch_patterns[idx]))
-    else: # Draw the bars next to the others
-        for idx,d in enumerate(data):
-            for i in xrange(num_clustered):
-                # this gives every n'th element given a starting position 'i'
-                # will give the values for a certain configuration for one breakdown component
-                dd = d[i::num_clustered]
-
-                assert(len(ind)==len(dd))
-                rects.append(ax.bar(left=left_empty+ind+(i*barwidth)+idx*one_barwidth, height=dd, width=one_barwidth,
-                                alpha=1, color=colors[idx], ecolor='black', edgecolor='black', hatch=hatch_patterns[idx]))
+    slots = np.arange(cfg.num_clustered)
+    for idx,d in enumerate(data):
+        # the values of a breakdown component, one row per cluster and one column per configuration
+        assert(len(d)==len(ind)*cfg.num_clustered)
+        errd = data_err[idx] if data_err else None
+        if cfg.stacked: # Draw the bars staked, errors at the top of each component
+            left = left_empty+ind[:,None]+slots*barwidth
+            rects.append(draw_bars(ax, left=left.ravel(), height=d, width=barwidth,
+                                bottom=y_stack[idx-1] if idx else 0,
+                                color=cfg.colors[idx], hatch=cfg.hatch_patterns[idx]))
+            draw_errorbars(ax, left.ravel()+barwidth/2., y_stack[idx], errd, cfg)
+        else: # Draw the bars next to the others
+            left = left_empty+ind[:,None]+slots*barwidth+idx*one_barwidth
+            rects.append(draw_bars(ax, left=left.ravel(), height=d, width=one_barwidth,
+                                color=cfg.colors[idx], hatch=cfg.hatch_patterns[idx]))
+            draw_errorbars(ax, left.ravel()+one_barwidth/2., d, errd, cfg)
 
     # put labels for data bars that overflow ylim
-    if 'ylim' in label_enable:
+    texts = []
+    if 'ylim' in cfg.label_enable:
         for i,elem in enumerate(y_stack[idx]):
-            if elem > ylim[1]:
-                ax.text(x=left_empty+(i*barwidth)+((i/num_clustered)*barwidth)+(barwidth/2.),
-                        y=ylim[1]+label_y_space, s='%s'%round(elem,2), ha='center', va='bottom',
-                        rotation=label_angle_rotation, fontsize=numbers_fontsize)
+            if elem > cfg.ylim[1]:
+                texts.append(ax.text(x=left_empty+(i*barwidth)+((i//cfg.num_clustered)*barwidth)+(barwidth/2.),
+                        y=cfg.ylim[1]+cfg.label_y_space, s='%s'%round(elem,2), ha='center', va='bottom',
+                        rotation=cfg.label_angle_rotation, fontsize=cfg.numbers_fontsize))
     # put labels for all data bars
-    if 'always' in label_enable:
+    if 'always' in cfg.label_enable:
         for i,elem in enumerate(y_stack[idx]):
             if not np.isfinite(elem):
                 elem = 0
-            ax.text(x=left_empty+(i*barwidth)+((i/num_clustered)*barwidth)+(barwidth/2.),
-                        y=elem+label_y_space, s='%s'%round(elem,2), ha='center', va='bottom',
-                        rotation=label_angle_rotation, fontsize=numbers_fontsize)
+            texts.append(ax.text(x=left_empty+(i*barwidth)+((i//cfg.num_clustered)*barwidth)+(barwidth/2.),
+                        y=elem+cfg.label_y_space, s='%s'%round(elem,2), ha='center', va='bottom',
+                        rotation=cfg.label_angle_rotation, fontsize=cfg.numbers_fontsize))
+    place_labels(ax, texts, cfg)
 
     # Check if secondary y axis
-    if line_split:
-        names = [elem[0] for elem in alldata2]
-        legend2 = list(sorted(set(names), key=names.index)) # Keep order
+    if cfg.line_split:
+        legend2, groups = group_rows(ds2[0]) # Keep order
         legend.extend(legend2)
 
         labels = []
         x = []
         y = []
         # get data from specified columns
-        for b in legend2:
-            if do_labels:
-                labels.append([elem[1] for elem in alldata2 if elem[0] == b])
-                x.append([elem[2] for elem in alldata2 if elem[0] == b])
-                y.append([elem[3] for elem in alldata2 if elem[0] == b])
+        for rows in groups:
+            if cfg.do_labels:
+                labels.append(ds2[1][rows])
+                x.append(ds2[2][rows])
+                y.append(ds2[3][rows])
             else:
-                x.append([elem[1] for elem in alldata2 if elem[0] == b])
-                y.append([elem[2] for elem in alldata2 if elem[0] == b])
+                x.append(ds2[1][rows])
+                y.append(ds2[2][rows])
 
         ax2 = ax.twinx()
-        ax2.set_yscale(yscale)
+        ax2.set_yscale(cfg.yscale)
         ax2.tick_params(axis='both', which='major', pad=5)
-        if do_x_as_xticks:
+        if cfg.do_x_as_xticks:
             ax2.set_xlim(x[0][0]-0.25, x[0][-1]+0.25)
-        if ylim2:
-            ax2.set_ylim(*ylim2)
-        if num_yticks:
-            ax2.set_yticks(np.linspace(ax2.get_ybound()[0], ax2.get_ybound()[1], num_yticks))
-        ax2.set_ylabel(ytitle2, fontsize=ytitle_fontsize)
+        if cfg.ylim2:
+            ax2.set_ylim(*cfg.ylim2)
+        if cfg.num_yticks:
+            ax2.set_yticks(np.linspace(ax2.get_ybound()[0], ax2.get_ybound()[1], cfg.num_yticks))
+        ax2.set_ylabel(cfg.ytitle2, fontsize=cfg.ytitle_fontsize)
         for item in ax2.get_yticklabels():
-            item.set_fontsize(ylabel_fontsize)
+            item.set_fontsize(cfg.ylabel_fontsize)
 
         # Plot all lines
         mylines = []
         for i,d in enumerate(x):
             mylines.append(ax2.plot(left_empty+ind+barwidth/2, y[i], alpha=1,
-                                color=linecolors[i],
-                                marker=marker_patterns[i],
-                                mec=linecolors[i],
-                                linestyle=line_styles[i],
-                                **lineargs))
-            if line_label_enable:
+                                color=cfg.linecolors[i],
+                                marker=cfg.marker_patterns[i],
+                                mec=cfg.linecolors[i],
+                                linestyle=cfg.line_styles[i],
+                                **cfg.lineargs))
+            if cfg.line_label_enable:
                 for j,coord in enumerate(y[i]):
                     # print coord
                     # ax.text(x=left_empty+ind[j]+barwidth/2, y=coord, s='%s'%round(coord,2), ha='center', va='bottom',
                         # rotation=label_angle_rotation, fontsize=numbers_fontsize)
-                    plt.annotate('%s'%round(coord,2),
+                    ax2.annotate('%s'%round(coord,2),
                              xy = (left_empty+ind[j]+barwidth/2, coord), xytext = (10, -10),
                              textcoords = 'offset points', ha = 'center', va = 'center',
                              # bbox = dict(boxstyle = 'round,pad=0.2', fc = 'black', alpha = .3),
@@ -289,10 +893,10 @@ def mk_clusterstacked(title, ra):
                              )
 
 
-        if do_labels:
+        if cfg.do_labels:
             for i,l in enumerate(labels):
                 for label, xval, yval in zip(labels[i], x[i], y[i]):
-                    plt.annotate(label,
+                    ax2.annotate(label,
                              xy = (xval, yval), xytext = (10, -10),
                              textcoords = 'offset points', ha = 'center', va = 'center',
                              # bbox = dict(boxstyle = 'round,pad=0.2', fc = 'black', alpha = .3),
@@ -300,98 +904,95 @@ def mk_clusterstacked(title, ra):
                              )
 
     # general formating
-    set_titles(ax, title, xtitle, ytitle, title_fontsize,
-                        xtitle_fontsize, ytitle_fontsize, ylabel_fontsize)
-    if num_yticks:
-        ax.set_yticks(np.linspace(ax.get_ybound()[0], ax.get_ybound()[1], num_yticks))
-    elif yticks:
-        ax.set_yticks(yticks)
+    set_titles(ax, title, cfg.xtitle, cfg.ytitle, cfg.title_fontsize,
+                        cfg.xtitle_fontsize, cfg.ytitle_fontsize, cfg.ylabel_fontsize, cfg.xlabel_fontsize)
+    if cfg.num_yticks:
+        ax.set_yticks(np.linspace(ax.get_ybound()[0], ax.get_ybound()[1], cfg.num_yticks))
+    elif cfg.yticks:
+        ax.set_yticks(cfg.yticks)
 
     # xticks possition and labels
-    ax.set_xticks(ind + left_empty + (num_clustered/2.0)*barwidth)
-    ax.set_xticklabels(xticks, y=xticks_y, fontsize=xlabel_fontsize, rotation=xticks_rotation)
-    plt.gcf().subplots_adjust(bottom=0.2)
+    ax.set_xticks(ind + left_empty + (cfg.num_clustered/2.0)*barwidth)
+    ax.set_xticklabels(xticks, y=cfg.xticks_y, fontsize=cfg.xlabel_fontsize, rotation=cfg.xticks_rotation)
+    fig.subplots_adjust(bottom=0.2)
 
     # sublabels for each element of the cluster
-    if do_sublabels:
-        for i in xrange(num_clustered):
-            for idx in xrange(len(ind)):
-                if stacked:
-                    ax.text(rects[i][idx].get_x()+rects[i][idx].get_width()/2., labels_y, '%s'%xticks_per_bar[i],
-                        ha='center', va='baseline', fontsize=text_fontsize, rotation=labels_rotation)
-                else:
-                    ax.text(rects[i][idx].get_x()+len(data)*(rects[i][idx].get_width()/2.), labels_y, '%s'%xticks_per_bar[i],
-                        ha='center', va='baseline', fontsize=text_fontsize, rotation=labels_rotation)
+    if cfg.do_sublabels:
+        # centered below the bars of each configuration
+        sublabel_offset = barwidth/2. if cfg.stacked else len(data)*one_barwidth/2.
+        for i in range(cfg.num_clustered):
+            for idx in range(len(ind)):
+                ax.text(left_empty+ind[idx]+i*barwidth+sublabel_offset, cfg.labels_y, '%s'%xticks_per_bar[i],
+                    ha='center', va='baseline', fontsize=cfg.text_fontsize, rotation=cfg.labels_rotation)
 
     # legend
-    if do_legend:
-        lencolors = [a[0] for a in rects[0::num_clustered]]
-        if line_split:
+    if cfg.do_legend:
+        lencolors = list(rects)
+        if cfg.line_split:
             lencolors.extend([a[0] for a in mylines])
         leg = ax.legend(lencolors, # get the right colors
               legend, # labels
-              loc=legend_loc,
-              ncol=legend_ncol,
+              loc=cfg.legend_loc,
+              ncol=cfg.legend_ncol,
               frameon=True,
               borderaxespad=0.5,
-              bbox_to_anchor=bbox,
+              bbox_to_anchor=cfg.bbox,
               fancybox=True,
               #prop={'size':10}, # smaller font size
               )
         for t in leg.get_texts():
-            t.set_fontsize(legend_fontsize)    # the legend text fontsize
+            t.set_fontsize(cfg.legend_fontsize)    # the legend text fontsize
     else:
         leg = ax.legend([], frameon=False)
 
     # Graph shrinking if desired, no shrinking by default
     box = ax.get_position()
-    ax.set_position([box.x0, box.y0, box.width * shrink_width_factor, box.height * shrink_height_factor])
+    ax.set_position([box.x0, box.y0, box.width * cfg.shrink_width_factor, box.height * cfg.shrink_height_factor])
 
     ax.set_axisbelow(True)
-    if line_split:
+    if cfg.line_split:
         ax2.set_axisbelow(True)
-    plt.gca().yaxis.grid(color='0.5', linestyle='--', linewidth=0.3)
-    plt.tight_layout()
-    return plt,leg
+    fig.gca().yaxis.grid(color='0.5', linestyle='--', linewidth=0.3)
+    return fig,leg
 
 
-def mk_barchart(title, ra):
-    # convert ra into header and data objects
-    alldata, header = parse_recarray(ra)
+def mk_barchart(title, ds, cfg, ax=None):
+    header = ds.names
 
     # labels, use benchmark names
-    xticks = list(OrderedDict.fromkeys([a[xticks_id] for a in alldata]))
+    xticks = unique_in_order(ds[cfg.xticks_id])
 
     # column names
-    if auto_column_names:
+    legend = list(cfg.column_names)
+    column_ids_data = cfg.column_ids_data
+    if cfg.auto_column_names:
         legend = header[1:]
         column_ids_data = range(1, len(legend)+1)
 
     # get data from specified columns
-    data, data_err = get_data(alldata, column_ids_data, column_ids_err)
+    data, data_err = get_data(ds, column_ids_data, cfg.column_ids_err)
 
-    # Add arithmetic and/or geometric means
-    if do_add_average:
-        data, data_err, xticks = add_average(data, data_err, xticks)
-    elif do_add_geomean:
-        data, data_err, xticks = add_geomean(data, data_err, xticks)
+    # Add summary rows
+    data, data_err, xticks = add_summaries(data, data_err, xticks, get_summaries(cfg))
 
     assert(len(legend)==len(data))
     ind = np.arange(len(xticks))    # the x locations for the groups
     barwidth = 1.0/(len(legend)+1)  # the width of the bars
 
-    # create a new figure and axes instance
-    fig = plt.figure(figsize=figure_size) # figure size specified in config
-    ax = fig.add_subplot(111)
+    # create a new figure and axes instance, unless drawing a panel of a grid
+    if ax is None:
+        fig = new_figure(cfg) # figure size specified in config
+        ax = fig.add_subplot(111)
+    fig = ax.figure
 
     # Set ylim and xlim
-    if ylim:
-        ax.set_ylim(*ylim)
+    if cfg.ylim:
+        ax.set_ylim(*cfg.ylim)
     ax.set_xlim(right=len(ind))
 
     # Set axis scales
-    ax.set_yscale(yscale)
-    ax.set_xscale(xscale)
+    ax.set_yscale(cfg.yscale)
+    ax.set_xscale(cfg.xscale)
 
     # Generate all bars
     rects = []
@@ -401,68 +1002,68 @@ def mk_barchart(title, ra):
             errd = data_err[i]
         else:
             errd = None
-        rects.append(ax.bar(left=left_empty+ind+i*barwidth, height=d, width=barwidth, alpha=1,
-                            color=colors[i], ecolor='black', edgecolor='black', hatch=hatch_patterns[i]))
+        rects.append(draw_bars(ax, left=left_empty+ind+i*barwidth, height=d, width=barwidth,
+                            color=cfg.colors[i], hatch=cfg.hatch_patterns[i]))
+        draw_errorbars(ax, left_empty+ind+i*barwidth+barwidth/2., d, errd, cfg)
 
     # put labels for data bars that overflow ylim
-    if ylim and label_enable:
+    if cfg.ylim and cfg.label_enable:
         for i,d in enumerate(data):
             for ii,bar in enumerate(d):
-                if bar > ylim[1]:
+                if bar > cfg.ylim[1]:
                     ax.text(x=left_empty+ind[ii]+(i*barwidth)+barwidth/2.,
-                            y=ylim[1]+label_y_space, s='%s'%round(bar,2),
+                            y=cfg.ylim[1]+cfg.label_y_space, s='%s'%round(bar,2),
                             ha='center', va='bottom',
-                            rotation=label_angle_rotation, fontsize=numbers_fontsize)
+                            rotation=cfg.label_angle_rotation, fontsize=cfg.numbers_fontsize)
 
     # general formating
-    set_titles(ax, title, xtitle, ytitle, title_fontsize,
-                        xtitle_fontsize, ytitle_fontsize, ylabel_fontsize)
+    set_titles(ax, title, cfg.xtitle, cfg.ytitle, cfg.title_fontsize,
+                        cfg.xtitle_fontsize, cfg.ytitle_fontsize, cfg.ylabel_fontsize, cfg.xlabel_fontsize)
 
     # xticks possition and labels
     ax.set_xticks(ind + left_empty + (len(legend)/2.0)*barwidth)
-    ax.set_xticklabels(xticks, fontsize=xlabel_fontsize, rotation=xticks_rotation)
-    plt.gcf().subplots_adjust(bottom=0.2)
+    ax.set_xticklabels(xticks, fontsize=cfg.xlabel_fontsize, rotation=cfg.xticks_rotation)
+    fig.subplots_adjust(bottom=0.2)
 
     # legend
-    if do_legend:
-        leg = ax.legend([a[0] for a in rects],
+    if cfg.do_legend:
+        leg = ax.legend(rects,
               legend,
-              loc=legend_loc,
-              ncol=legend_ncol,
+              loc=cfg.legend_loc,
+              ncol=cfg.legend_ncol,
               frameon=True,
               borderaxespad=1.,
-              bbox_to_anchor=bbox,
+              bbox_to_anchor=cfg.bbox,
               fancybox=True,
               #prop={'size':10}, # smaller font size
               )
         for t in leg.get_texts():
-            t.set_fontsize(legend_fontsize)    # the legend text fontsize
+            t.set_fontsize(cfg.legend_fontsize)    # the legend text fontsize
     else:
         leg = ax.legend([], frameon=False)
 
     # Draw horizontal lines
-    for line in hlines:
+    for line in cfg.hlines:
         ax.axhline(**line)
 
     # Draw text labels
-    for text in text_labels:
+    for text in cfg.text_labels:
         ax.text(**text)
 
     # Graph shrinking if desired, no shrinking by default
     box = ax.get_position()
-    ax.set_position([box.x0, box.y0, box.width * shrink_width_factor, box.height * shrink_height_factor])
+    ax.set_position([box.x0, box.y0, box.width * cfg.shrink_width_factor, box.height * cfg.shrink_height_factor])
 
     ax.set_axisbelow(True)
-    if line_split:
+    if cfg.line_split:
         ax2.set_axisbelow(True)
-    plt.gca().yaxis.grid(color='0.5', linestyle='--', linewidth=0.3)
-    plt.tight_layout()
-    return plt,leg
-
-def get_line_data(data):
-    labels = [a[1] for a in data]
-    x = [a[2] for a in data]
-    y = [a[3] for a in data]
+    fig.gca().yaxis.grid(color='0.5', linestyle='--', linewidth=0.3)
+    return fig,leg
+
+def get_line_data(ds):
+    labels = ds[1]
+    x = ds[2]
+    y = ds[3]
     return labels, x, y
 
 def angle_between(p1, p2):
@@ -475,261 +1076,277 @@ def angle_between(p1, p2):
 # ceilings[1] = [ GB/s (float) , ...]
 # ceilings[2] = [ cpu_ceiling_name, ...]
 # ceilings[3] = [ Gflops/s (float) , ...]
-# ra format:
+# ds format:
 # [ "legend elem", "data label", Operational intensity (float) , Gflops/s (float) ]
 # [ "legend elem", "data label", Operational intensity (float) , Gflops/s (float) ]
-def mk_roofline(title, ceilings, ra):
-    alldata, header = parse_recarray(ra)
-
+def mk_roofline(title, ceilings, ds, cfg, ax=None):
     mem_ceiling_names = ceilings[0]
     mem_ceiling_values = ceilings[1]
     cpu_ceiling_names = ceilings[2]
     cpu_ceiling_values = ceilings[3]
-    application_data = alldata
+    labels, oi, gflops = get_line_data(ds)
 
-    names = [elem[0] for elem in application_data]
-    legend = list(sorted(set(names), key=names.index)) # Keep order
+    legend = unique_in_order(ds[0]) # Keep order
 
-    # create a new figure and axes instance
-    fig = plt.figure(figsize=figure_size) # figure size specified in config
-    ax = fig.add_subplot(111)
+    # create a new figure and axes instance, unless drawing a panel of a grid
+    if ax is None:
+        fig = new_figure(cfg) # figure size specified in config
+        ax = fig.add_subplot(111)
+    fig = ax.figure
 
     # Set axis scales
-    ax.set_yscale(yscale, basey=2)
-    ax.set_xscale(xscale, basex=2)
+    # powers of two on log axes, other scales take no base
+    ax.set_yscale(cfg.yscale, **({'base' : 2} if cfg.yscale == 'log' else {}))
+    ax.set_xscale(cfg.xscale, **({'base' : 2} if cfg.xscale == 'log' else {}))
 
     # Set ylim and xlim
-    if ylim:
-        ax.set_ylim(*ylim)
-    try:
-        ax.set_xlim(*xlim)
-    except NameError:
-        pass
-    if yticks:
+    if cfg.ylim:
+        ax.set_ylim(*cfg.ylim)
+    if cfg.xlim:
+        ax.set_xlim(*cfg.xlim)
+    if cfg.yticks:
         # ax.set_yticks(np.linspace(ax.get_ybound()[0], ax.get_ybound()[1], num_yticks))
         #plt.locator_params(axis='y', nbins=num_yticks)
-        ax.set_yticks(yticks)
+        ax.set_yticks(cfg.yticks)
     max_flops = max(cpu_ceiling_values)
     max_bw = max(mem_ceiling_values)
-    global xticks
+    xticks = cfg.xticks
     if xticks is None:
         xticks = [2.**i for i in range(-4, int(log(max_flops/float(max_bw),2))+2)]
 
     ax.set_xticks(xticks)
-    x = list(frange(min(xticks), max(xticks), 0.01))
+    xmin, xmax = min(xticks), max(xticks)
 
-    # Upper bw bound
+    # Upper bw bound: rises until its ridge point with the highest cpu ceiling, then flat
     for i,elem in enumerate(mem_ceiling_values):
-        ax.plot(x, [min(elem*val, float(max_flops)) for val in x], color=mem_linecolors[i], linewidth=3 if i == 0 else 2)
-        xdiff = x[10] - x[1]
-        ydiff = (x[10]*elem) - (x[1]*elem)
-        angle = degrees(atan2(ydiff, xdiff))
-        plot_location = np.array([x[1], elem*x[1]])
-        trans_angle = plt.gca().transData.transform_angles(np.array((angle,)),
-                                                   plot_location.reshape((1, 2)))[0]
-        ax.text(x[1], elem*x[1], mem_ceiling_names[i], size=text_fontsize, rotation=trans_angle, horizontalalignment = 'left', verticalalignment = 'bottom')
-
-    # Upper cpu bound
-    cpu_text_pos = -len(x) / 6
+        ridge = max_flops/float(elem)
+        x = np.array([xmin] + ([ridge] if xmin < ridge < xmax else []) + [xmax])
+        ax.plot(x, np.minimum(elem*x, max_flops), color=cfg.mem_linecolors[i], linewidth=3 if i == 0 else 2)
+
+        # label along the rising part: its angle is the slope in data space, turned
+        # into the angle on screen when drawn, once limits and layout are final
+        xtext = xmin + 0.02
+        ax.text(xtext, elem*xtext, mem_ceiling_names[i], size=cfg.text_fontsize,
+                rotation=degrees(atan2(elem, 1.)), transform_rotates_text=True,
+                horizontalalignment = 'left', verticalalignment = 'bottom')
+
+    # Upper cpu bound: flat from its ridge point with the highest bandwidth
     for i,elem in enumerate(cpu_ceiling_values):
-        ax.plot([max(elem/float(max_bw), val) for val in x], [elem for val in x], color=cpu_linecolors[i], linewidth=3 if i==0 else 2)
-        ax.text(x[cpu_text_pos], elem+2, cpu_ceiling_names[i], size=text_fontsize, horizontalalignment='right')
-        ax.plot(x[cpu_text_pos/2], elem, marker_patterns[len(cpu_ceiling_values)-1-i], color='k', markersize=marker_sizes[num_points-1-i])
+        ridge = elem/float(max_bw)
+        ax.plot([max(ridge, xmin), max(ridge, xmax)], [elem, elem], color=cfg.cpu_linecolors[i], linewidth=3 if i==0 else 2)
+        ax.text(xmin + (xmax - xmin)*5/6., elem+2, cpu_ceiling_names[i], size=cfg.text_fontsize, horizontalalignment='right')
+        ax.plot(xmin + (xmax - xmin)*11/12., elem, cfg.marker_patterns[len(cpu_ceiling_values)-1-i], color='k', markersize=cfg.marker_sizes[cfg.num_points-1-i])
 
-    # Application data
+    # Application data: a vertical line per application, the points sharing a
+    # marker (the same position within their application) are one collection
     mylines = []
-    mymarkers = []
-    for i,elem in enumerate(application_data):
-        if i%num_points == 1:
-            mylines.append(ax.plot([elem[2],elem[2]], [0, max_flops], color=linecolors[i/num_points],linestyle=line_styles[i%num_points], **lineargs))
-        mymarkers.append(ax.plot(elem[2], elem[3], marker_patterns[i%num_points], color=linecolors[i/num_points],
-                markersize=marker_sizes[i%num_points],markeredgecolor='k',markeredgewidth=1.5))
-        # mymarkers.append(ax.plot(elem[2], elem[3], color=linecolors[i%num_points], label=elem[1]))
+    for i in range(1, len(ds), cfg.num_points):
+        mylines.append(ax.plot([oi[i],oi[i]], [0, max_flops], color=cfg.linecolors[i//cfg.num_points],linestyle=cfg.line_styles[i%cfg.num_points], **cfg.lineargs))
+    point_colors = [cfg.linecolors[i//cfg.num_points] for i in range(len(ds))]
+    for k in range(min(cfg.num_points, len(ds))):
+        rows = np.arange(k, len(ds), cfg.num_points)
+        ax.scatter(np.asarray(oi)[rows], np.asarray(gflops)[rows], marker=cfg.marker_patterns[k],
+                s=cfg.marker_sizes[k]**2, facecolors=[point_colors[i] for i in rows],
+                edgecolors='k', linewidths=1.5, zorder=2.5)
 
     # plot points
-    for pnt in points:
+    for pnt in cfg.points:
         ax.plot(pnt["x"], pnt["y"], color = pnt["color"], marker = pnt["marker"], markersize = pnt["markersize"], mec = pnt["mec"])
 
     # Draw horizontal lines
-    for line in hlines:
+    for line in cfg.hlines:
         ax.axhline(**line)
 
     # Draw horizontal lines
-    for line in vlines:
+    for line in cfg.vlines:
         ax.axvline(**line)
 
     # Draw text labels
-    for text in text_labels:
+    for text in cfg.text_labels:
         ax.text(**text)
 
     # general formating
-    set_titles(ax, title, xtitle, ytitle, title_fontsize,
-                        xtitle_fontsize, ytitle_fontsize, ylabel_fontsize)
+    set_titles(ax, title, cfg.xtitle, cfg.ytitle, cfg.title_fontsize,
+                        cfg.xtitle_fontsize, cfg.ytitle_fontsize, cfg.ylabel_fontsize, cfg.xlabel_fontsize)
 
     # Graph shrinking if desired, no shrinking by default
     box = ax.get_position()
-    ax.set_position([box.x0, box.y0, box.width * shrink_width_factor, box.height * shrink_height_factor])
+    ax.set_position([box.x0, box.y0, box.width * cfg.shrink_width_factor, box.height * cfg.shrink_height_factor])
 
     # legend
-    if do_legend:
+    if cfg.do_legend:
         leg = ax.legend([a[0] for a in mylines],
               legend,
-              loc=legend_loc,
-              ncol=legend_ncol,
+              loc=cfg.legend_loc,
+              ncol=cfg.legend_ncol,
               frameon=True,
               borderaxespad=1.,
-              bbox_to_anchor=bbox,
+              bbox_to_anchor=cfg.bbox,
               fancybox=True,
               #prop={'size':10}, # smaller font size
               )
         for line in leg.get_lines():
             line.set_linewidth(line.get_linewidth()*2)
         for t in leg.get_texts():
-            t.set_fontsize(legend_fontsize)    # the legend text fontsize
+            t.set_fontsize(cfg.legend_fontsize)    # the legend text fontsize
     else:
         leg = ax.legend([], frameon=False)
 
     ax.set_axisbelow(True)
-    ax.xaxis.set_major_formatter(plt.ScalarFormatter())
-    ax.yaxis.set_major_formatter(plt.ScalarFormatter())
-    plt.gca().yaxis.grid(color='0.5', linestyle='--', linewidth=0.3)
-    plt.tight_layout()
-    return plt,leg
+    from matplotlib.ticker import ScalarFormatter
+    ax.xaxis.set_major_formatter(ScalarFormatter())
+    ax.yaxis.set_major_formatter(ScalarFormatter())
+    fig.gca().yaxis.grid(color='0.5', linestyle='--', linewidth=0.3)
+    return fig,leg
 
 # expects ["legend element", "data point label", "x", "y"]
-def mk_linechart(title, ra):
-    # convert ra into header and data objects
-    alldata, header = parse_recarray(ra)
-
-    names = [elem[0] for elem in alldata]
-    legend = list(sorted(set(names), key=names.index)) # Keep order
+def mk_linechart(title, ds, cfg, ax=None):
+    legend, groups = group_rows(ds[0]) # Keep order
 
     labels = []
     x = []
     y = []
-    # get data from specified columns
-    for b in legend:
-        if do_labels:
-            labels.append([elem[1] for elem in alldata if elem[0] == b])
-            x.append([elem[2] for elem in alldata if elem[0] == b])
-            y.append([elem[3] for elem in alldata if elem[0] == b])
-        else:
-            x.append([elem[1] for elem in alldata if elem[0] == b])
-            y.append([elem[2] for elem in alldata if elem[0] == b])
-
-    # Add arithmetic and/or geometric means
-    if do_add_average:
-        print('Warning AVERAGE not implemented for cluster stacked plots')
-    elif do_add_geomean:
-        gmean = []
-        for i in range(len(y[0])):
-            gmean.append(reduce(lambda xx, yy: xx*yy, [elem[i] for elem in y])**(1.0/len(y[0])))
-        y.append(gmean)
-        legend.append('Geomean')
+    yerr = []
+    # get data from specified columns, errors from the first of column_ids_err or aggregation
+    ycol = 3 if cfg.do_labels else 2
+    err = ds[cfg.column_ids_err[0]] if cfg.column_ids_err else ds.error(ycol)
+    for rows in groups:
+        if cfg.do_labels:
+            labels.append(ds[1][rows])
+        x.append(ds[ycol-1][rows])
+        y.append(ds[ycol][rows])
+        yerr.append(err[rows] if err is not None else None)
+
+    # Add summary series, reducing all series point by point
+    series = list(y)
+    for how in get_summaries(cfg):
+        if len(set(len(elem) for elem in series)) != 1:
+            raise ValueError("Summary series need all series to have the same number of points")
+        y.append(summarize(series, how, axis=0))
+        yerr.append(None)
+        legend.append(SUMMARY_NAMES[how])
         x.append(x[0])
+        if cfg.do_labels:
+            labels.append(np.repeat('', len(x[0])))
 
-    if do_labels:
+    if cfg.do_labels:
         assert(len(legend)==len(labels)==len(x)==len(y))
     else:
         assert(len(legend)==len(x)==len(y))
 
-    # create a new figure and axes instance
-    fig = plt.figure(figsize=figure_size) # figure size specified in config
-    ax = fig.add_subplot(111)
+    # create a new figure and axes instance, unless drawing a panel of a grid
+    if ax is None:
+        fig = new_figure(cfg) # figure size specified in config
+        ax = fig.add_subplot(111)
+    fig = ax.figure
 
     # Set axis scales
-    ax.set_yscale(yscale)
-    ax.set_xscale(xscale)
+    ax.set_yscale(cfg.yscale)
+    ax.set_xscale(cfg.xscale)
 
     # Set ylim and xlim
-    if ylim:
-        ax.set_ylim(*ylim)
-    try:
-        ax.set_xlim(*xlim)
-    except NameError:
-        pass
-    if num_yticks:
+    if cfg.ylim:
+        ax.set_ylim(*cfg.ylim)
+    if cfg.xlim:
+        ax.set_xlim(*cfg.xlim)
+    if cfg.num_yticks:
         # ax.set_yticks(np.linspace(ax.get_ybound()[0], ax.get_ybound()[1], num_yticks))
-        plt.locator_params(axis='y', nbins=num_yticks)
-    if num_xticks:
-        plt.locator_params(axis='x', nbins=num_xticks)
+        ax.locator_params(axis='y', nbins=cfg.num_yticks)
+    if cfg.num_xticks:
+        ax.locator_params(axis='x', nbins=cfg.num_xticks)
 
-    global yticks
-    if yticks is not None:
-        ax.set_yticks(yticks)
+    if cfg.yticks is not None:
+        ax.set_yticks(cfg.yticks)
 
-    global xticks
-    if xticks is not None:
-        ax.set_xticks(xticks)
+    if cfg.xticks is not None:
+        ax.set_xticks(cfg.xticks)
 
     ax.tick_params(axis='both', which='major', pad=5)
     # Plot x as xticks
-    if do_x_as_xticks:
+    if cfg.do_x_as_xticks:
         xticks_labels = [[str(j) for j in elem] for elem in x]
         x = [range(1,len(elem)+1) for elem in x]
         ax.set_xlim(x[0][0]-0.25, x[0][-1]+0.25)
         # xticks possition and labels
         ax.set_xticks(x[0])
-        ax.set_xticklabels(xticks_labels[0], fontsize=xlabel_fontsize, rotation=xticks_rotation)
-        plt.gcf().subplots_adjust(bottom=0.2)
+        ax.set_xticklabels(xticks_labels[0], fontsize=cfg.xlabel_fontsize, rotation=cfg.xticks_rotation)
+        fig.subplots_adjust(bottom=0.2)
 
     # Check if secondary y axis
-    if line_split:
+    if cfg.line_split:
         ax2 = ax.twinx()
-        ax2.set_yscale(yscale)
+        ax2.set_yscale(cfg.yscale)
         ax2.tick_params(axis='both', which='major', pad=5)
-        if do_x_as_xticks:
+        if cfg.do_x_as_xticks:
             ax2.set_xlim(x[0][0]-0.25, x[0][-1]+0.25)
-        if ylim2:
-            ax2.set_ylim(*ylim2)
-        if num_yticks:
+        if cfg.ylim2:
+            ax2.set_ylim(*cfg.ylim2)
+        if cfg.num_yticks:
             # ax2.set_yticks(np.linspace(ax2.get_ybound()[0], ax2.get_ybound()[1], num_yticks))
-            plt.locator_params(axis='y', nbins=num_yticks)
-        if num_xticks:
-            plt.locator_params(axis='x', nbins=num_xticks)
-        ax2.set_ylabel(ytitle2, fontsize=ytitle_fontsize)
+            ax2.locator_params(axis='y', nbins=cfg.num_yticks)
+        if cfg.num_xticks:
+            ax2.locator_params(axis='x', nbins=cfg.num_xticks)
+        ax2.set_ylabel(cfg.ytitle2, fontsize=cfg.ytitle_fontsize)
         for item in ax2.get_yticklabels():
-            item.set_fontsize(ylabel_fontsize)
+            item.set_fontsize(cfg.ylabel_fontsize)
+
+    # Decimate long series, unless every point is an xtick category
+    if cfg.downsample and not cfg.do_x_as_xticks:
+        points = int(cfg.downsample_points * cfg.figure_size[0])
+        for i in range(len(x)):
+            keep = downsample(x[i], y[i], points, cfg.downsample)
+            if keep is not None:
+                x[i], y[i] = np.asarray(x[i])[keep], np.asarray(y[i])[keep]
+                if yerr[i] is not None:
+                    yerr[i] = yerr[i][keep]
+                if cfg.do_labels:
+                    labels[i] = np.asarray(labels[i])[keep]
 
     # Plot all lines
     mylines = []
     texts = []
     for i,d in enumerate(x):
-        if line_split and i >= line_split:
+        if cfg.line_split and i >= cfg.line_split:
             mylines.append(ax2.plot(x[i], y[i], alpha=1,
-                                color=linecolors[i],
-                                marker=marker_patterns[i],
-                                mec=linecolors[i],
-                                linestyle=line_styles[i],
-                                **lineargs))
-            if do_labels:
+                                color=cfg.linecolors[i],
+                                marker=cfg.marker_patterns[i],
+                                mec=cfg.linecolors[i],
+                                linestyle=cfg.line_styles[i],
+                                **cfg.lineargs))
+            draw_errorbars(ax2, x[i], y[i], yerr[i], cfg, color=cfg.linecolors[i])
+            if cfg.do_labels:
                 for label, xval, yval in zip(labels[i], x[i], y[i]):
+                    if not label:
+                        continue
                     # ax2.annotate(label,
                                  # xy = (xval, yval), xytext = xytext_tomarker,
                                  # textcoords = 'offset points', ha = 'center', va = 'center', fontsize = text_fontsize,
                                  # )
-                    texts.append(ax2.text(xval,yval,label,size=text_fontsize))
+                    texts.append(ax2.text(xval,yval,label,size=cfg.text_fontsize))
                 # adjust_text(texts, arrowprops=dict(arrowstyle="-", color='k', lw=0.5))
                 # adjust_text(texts)
         else:
             mylines.append(ax.plot(x[i], y[i], alpha=1,
-                                color=linecolors[i],
-                                marker=marker_patterns[i],
-                                mec=linecolors[i],
-                                linestyle=line_styles[i],
-                                **lineargs))
-            if do_labels:
+                                color=cfg.linecolors[i],
+                                marker=cfg.marker_patterns[i],
+                                mec=cfg.linecolors[i],
+                                linestyle=cfg.line_styles[i],
+                                **cfg.lineargs))
+            draw_errorbars(ax, x[i], y[i], yerr[i], cfg, color=cfg.linecolors[i])
+            if cfg.do_labels:
                 for label, xval, yval in zip(labels[i], x[i], y[i]):
+                    if not label:
+                        continue
                     # ax.annotate(label,
                                  # xy = (xval, yval), xytext = xytext_tomarker,
                                  # textcoords = 'offset points', ha = 'center', va = 'center', fontsize = text_fontsize,
                                  # )
-                    texts.append(ax.text(xval,yval,label,size=text_fontsize))
+                    texts.append(ax.text(xval,yval,label,size=cfg.text_fontsize))
                 # adjust_text(texts, arrowprops=dict(arrowstyle="-", color='k', lw=0.5))
                 # adjust_text(texts)
     # adjust_text(texts, force_objects=0,force_text=0.05, add_objects=[item for sublist in mylines for item in sublist])
     # adjust_text(texts, force_objects=0, add_objects=[item for sublist in mylines for item in sublist]) # DEFAULT
-    adjust_text(texts)
+    place_labels(ax, texts, cfg, [line for sublist in mylines for line in sublist])
     # adjust_text(texts, arrowprops=dict(arrowstyle="-", color='k', lw=0.5))
 
 
@@ -745,136 +1362,1008 @@ def mk_linechart(title, ra):
                              # )
 
     # plot points
-    for pnt in points:
+    for pnt in cfg.points:
         ax.plot(pnt["x"], pnt["y"], color = pnt["color"], marker = pnt["marker"], markersize = pnt["markersize"], mec = pnt["mec"])
 
     # Draw horizontal lines
-    for line in hlines:
+    for line in cfg.hlines:
         ax.axhline(**line)
 
     # Draw text labels
-    for text in text_labels:
+    for text in cfg.text_labels:
         ax.text(**text)
 
     # general formating
-    set_titles(ax, title, xtitle, ytitle, title_fontsize,
-                        xtitle_fontsize, ytitle_fontsize, ylabel_fontsize)
+    set_titles(ax, title, cfg.xtitle, cfg.ytitle, cfg.title_fontsize,
+                        cfg.xtitle_fontsize, cfg.ytitle_fontsize, cfg.ylabel_fontsize, cfg.xlabel_fontsize)
 
     # Graph shrinking if desired, no shrinking by default
     box = ax.get_position()
-    ax.set_position([box.x0, box.y0, box.width * shrink_width_factor, box.height * shrink_height_factor])
+    ax.set_position([box.x0, box.y0, box.width * cfg.shrink_width_factor, box.height * cfg.shrink_height_factor])
 
     # legend
-    if do_legend:
+    if cfg.do_legend:
         leg = ax.legend([a[0] for a in mylines],
               legend,
-              loc=legend_loc,
-              ncol=legend_ncol,
+              loc=cfg.legend_loc,
+              ncol=cfg.legend_ncol,
               frameon=True,
               borderaxespad=1.,
-              bbox_to_anchor=bbox,
+              bbox_to_anchor=cfg.bbox,
               fancybox=True,
               #prop={'size':10}, # smaller font size
               )
         for t in leg.get_texts():
-            t.set_fontsize(legend_fontsize)    # the legend text fontsize
+            t.set_fontsize(cfg.legend_fontsize)    # the legend text fontsize
     else:
         leg = ax.legend([], frameon=False)
 
     ax.set_axisbelow(True)
-    if line_split:
+    if cfg.line_split:
         ax2.set_axisbelow(True)
-    plt.gca().yaxis.grid(color='0.5', linestyle='--', linewidth=0.3)
-    plt.tight_layout()
-    return plt,leg
+    fig.gca().yaxis.grid(color='0.5', linestyle='--', linewidth=0.3)
+    return fig,leg
 
 
-def load_default_config():
-    default_config_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'default_config.py')
-    execfile(default_config_path, globals(), globals())
+class Config(object):
+    # Read-only settings of a folder, options are read as attributes (cfg.ylim).
+    # files lists the local configuration files applied, outermost first, and
+    # rc the rcParams they changed w.r.t. the matplotlib defaults.
+    __slots__ = ('_values', 'files', 'rc')
 
+    def __init__(self, values, files, rc):
+        object.__setattr__(self, '_values', values)
+        object.__setattr__(self, 'files', files)
+        object.__setattr__(self, 'rc', rc)
 
-def mk_charts(basedir):
-    for root, dirs, files in os.walk(basedir):
+    def __getattr__(self, name):
+        try:
+            return self._values[name]
+        except KeyError:
+            raise AttributeError("No configuration option '%s'" % name)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Configuration is read-only, set '%s' in a configuration file" % name)
 
-        # Reset default config and load local config if any
-        load_default_config()
+    def get(self, name, default=None):
+        return self._values.get(name, default)
 
-        rootpart = ""
-        for d in root.split('/'):
-            rootpart += "%s/" % d
-            config = "%s%s" % (rootpart, config_fname)
-            if os.path.isfile(config):
-                execfile(config, globals(), globals())
+
+DEFAULT_CONFIG = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'default_config.py')
+
+# compiled configuration files by path, with the mtime they were compiled at
+_compiled_configs = {}
+
+def compile_config(path):
+    mtime = os.path.getmtime(path)
+    if path not in _compiled_configs or _compiled_configs[path][0] != mtime:
+        with open(path, 'r') as f:
+            _compiled_configs[path] = (mtime, compile(f.read(), path, 'exec'))
+    return _compiled_configs[path]
+
+
+def config_namespace():
+    # names configuration files could use when they ran in paperplot's own globals
+    import string
+    from collections import OrderedDict
+    from matplotlib.colors import colorConverter
+    return { 'os' : os, 'sys' : sys, 'string' : string, 'np' : np, 'mp' : mp, 'csv' : csv,
+             'log' : log, 'atan2' : atan2, 'degrees' : degrees,
+             'colorConverter' : colorConverter, 'OrderedDict' : OrderedDict }
+
+
+def overlay_config(parent, path):
+    # run a configuration file on top of the parent settings (None for the defaults)
+    if parent is None:
+        values, files, rc = config_namespace(), [], {}
+    else:
+        # containers are copied so in place changes do not leak into the parent
+        values = dict((k, copy.copy(v) if isinstance(v, (list, dict, set)) else v)
+                      for k, v in parent._values.items())
+        files, rc = parent.files + [path], parent.rc
+
+    with mp.rc_context():
+        mp.rc_file_defaults()
+        defaults = dict(mp.rcParams)
+        mp.rcParams.update(rc)
+        exec(compile_config(path)[1], values)
+        rc = dict((k, v) for k, v in mp.rcParams.items() if defaults.get(k) != v)
+
+    return Config(values, files, rc)
+
+
+# resolved configuration of every folder prefix: (parent, config file mtime, config)
+_resolved_configs = {}
+
+def resolve_config(root):
+    # Settings of a folder: default_config.py, then the local configuration file
+    # of each folder from the top one down to root. Each folder prefix is
+    # resolved once from its parent and cached until one of its files changes.
+    cfg = resolve_default_config()
+    rootpart = ""
+    for d in root.split('/'):
+        rootpart += "%s/" % d
+        config = "%s%s" % (rootpart, cfg.config_fname)
+        mtime = os.path.getmtime(config) if os.path.isfile(config) else None
+        cached = _resolved_configs.get(config)
+        if cached is None or cached[0] is not cfg or cached[1] != mtime:
+            cached = (cfg, mtime, overlay_config(cfg, config) if mtime is not None else cfg)
+            _resolved_configs[config] = cached
+        cfg = cached[2]
+    return cfg
+
+
+def resolve_default_config():
+    mtime = os.path.getmtime(DEFAULT_CONFIG)
+    cached = _resolved_configs.get(DEFAULT_CONFIG)
+    if cached is None or cached[1] != mtime:
+        cached = (None, mtime, overlay_config(None, DEFAULT_CONFIG))
+        _resolved_configs[DEFAULT_CONFIG] = cached
+    return cached[2]
+
+
+def split_data_name(f, extensions):
+    # (name, extension) of a data file, the longest extension matching, e.g.
+    # ('results', '.csv.gz'); (f, None) if it is not a data file
+    for ext in sorted(extensions, key=len, reverse=True):
+        if f.endswith(ext) and len(f) > len(ext):
+            return f[:-len(ext)], f[-len(ext):]
+    return f, None
+
+
+def plan_charts(basedir, errors=None):
+    # walk basedir once and list every figure to be rendered as a job:
+    # (folder, file name, extension, local configs applying to the folder);
+    # a grid is a single job named after the grid, its extension is the tuple
+    # of (file name, extension) of its panels. With a list as errors, folders
+    # whose configuration fails are added to it as (folder, traceback) and
+    # skipped with their subfolders, and data files drawing the same figure as
+    # (figure, message), instead of raising.
+    jobs = []
+    for root, dirs, files in os.walk(basedir):
+        try:
+            cfg = resolve_config(root)
+        except Exception:
+            if errors is None:
+                raise
+            errors.append((root, traceback.format_exc()))
+            dirs[:] = []
+            continue
 
         # For each file in dir
-        for f in files:
-            fname, fext = os.path.splitext(f)
-            # extensions: csv
-            if fext not in EXTENSIONS:
+        panels = []
+        for f in sorted(files):
+            fname, fext = split_data_name(f, cfg.EXTENSIONS)
+            # extensions: csv, compressed csv
+            if fext is None:
+                continue
+            panels.append((fname, fext))
+        if cfg.grid and panels:
+            jobs.append((root, grid_name(root, cfg), tuple(panels), cfg.files))
+            continue
+        # data files differing only in their extension (x.csv, x.csv.gz) would
+        # write the same figure, none of them is drawn
+        byname = {}
+        for fname, fext in panels:
+            byname.setdefault(fname, []).append(fext)
+        for fname, fexts in byname.items():
+            if len(fexts) == 1:
+                jobs.append((root, fname, fexts[0], cfg.files))
                 continue
+            message = "%s all draw the figure %s/%s, keep only one of them" % (
+                ', '.join(fname + fext for fext in fexts), root, fname)
+            if errors is None:
+                raise ValueError(message)
+            errors.append(('%s/%s' % (root, fname), message))
+    return jobs
+
+
+def grid_name(root, cfg):
+    return cfg.grid_name or os.path.basename(os.path.abspath(root))
+
+
+def job_name(job):
+    # the data file of a job, for messages
+    root, fname, fext, configs = job
+    if isinstance(fext, tuple):
+        return '%s/%s (grid of %d)' % (root, fname, len(fext))
+    return '%s/%s%s' % (root, fname, fext)
+
+
+def render_chart(job):
+    root, fname, fext, configs = job
+    with timed('config'):
+        cfg = resolve_config(root)
+    with mp.rc_context():
+        mp.rc_file_defaults()
+        mp.rcParams.update(cfg.rc)
+        set_tex_cache(cfg)
+        draw_chart(root, fname, fext, cfg)
+
+
+def output_files(root, fname, cfg):
+    # (path, format, dpi) of every file written for a figure, one per entry of
+    # output_formats; the dpi is part of the name only when a format is repeated
+    formats = [f if isinstance(f, (tuple, list)) else (f, None) for f in cfg.output_formats]
+    exts = [fmt for fmt, dpi in formats]
+    files = []
+    for fmt, dpi in formats:
+        if exts.count(fmt) > 1:
+            # named after the dpi savefig picks when the entry gives none
+            name_dpi = dpi if dpi is not None else savefig_dpi(cfg)
+            files.append(("%s/%s-%ddpi.%s" % (root, fname, name_dpi, fmt), fmt, dpi))
+        else:
+            files.append(("%s/%s.%s" % (root, fname, fmt), fmt, dpi))
+    paths = [path for path, fmt, dpi in files]
+    for path in paths:
+        if paths.count(path) > 1:
+            raise ValueError("output_formats writes %s twice, give each %s entry a different dpi"
+                             % (path, os.path.splitext(path)[1][1:]))
+    return files
+
+
+def savefig_dpi(cfg):
+    # dpi savefig uses for outputs without one, under the rc settings of cfg
+    with mp.rc_context():
+        mp.rc_file_defaults()
+        mp.rcParams.update(cfg.rc)
+        dpi = mp.rcParams['savefig.dpi']
+        return mp.rcParams['figure.dpi'] if dpi == 'figure' else dpi
+
+
+def get_crop_box(fig, artists, pad):
+    # bounding box of everything drawn on the figure, in inches, so that every
+    # output is cropped in process without laying the figure out again
+    from matplotlib.transforms import Bbox
+    renderer = get_renderer(fig)
+    boxes = [fig.get_tightbbox(renderer)]
+    for a in artists:
+        if a.get_visible():
+            boxes.append(Bbox(a.get_window_extent(renderer).get_points() / fig.dpi))
+    return Bbox.union(boxes).padded(pad)
+
+
+def draw_chart(root, fname, fext, cfg):
+    files = output_files(root, fname, cfg)
+    print("Updating the figure %s/%s (%s)" % (root, fname, ', '.join(fmt for path, fmt, dpi in files)))
+    with timed('parse'):
+        panels = load_figure(root, fname, fext, cfg)
+    with timed('build'):
+        fig, leg = build_figure(panels, cfg)
+    draws = count_draws(fig) if _stage_times is not None else None
+    try:
+        with timed('layout'):
+            layout_chart(fig, cfg)
+        with timed('save'):
+            save_chart(fig, leg, files, cfg)
+    finally:
+        if draws is not None:
+            fig.canvas.mpl_disconnect(draws[1])
+            _stage_times['draws'] = draws[0][0]
+        release_figure(fig)
+
+
+def count_draws(fig):
+    # ([draws], callback id): full passes over the figure's artists from now on,
+    # outputs written and measuring passes of savefig alike
+    draws = [0]
+    def on_draw(event):
+        draws[0] += 1
+    return draws, fig.canvas.mpl_connect('draw_event', on_draw)
+
+
+def load_chart(root, fname, fext, cfg):
+    # data of a figure after rowfilters, colfilters, newfields, aggregation and sortby, and
+    # the ceilings of rooflines (None for other chart types)
+    filename = '%s/%s%s' % (root, fname, fext)
+    ds = select_results(Dataset.from_recarray(load_csv(filename, cfg)),
+                        cfg.rowfilters, cfg.colfilters, cfg.sortby, cfg.newfields,
+                        cfg.aggregate_by, cfg.aggregate, cfg.aggregate_err)
+    ceilings = None
+    if cfg.chart_type == "roofline":
+        # Open the file that contains the ceilings
+        filename_ceilings = '%s/%s.cei' % (root, fname)
+        with open(filename_ceilings, 'r') as f:
+            reader = csv.reader(f)
+            ceilings = list(reader)
+        for row in [1,3]:
+            for i in range(len(ceilings[row])):
+                ceilings[row][i] = float(ceilings[row][i])
+    return ds, ceilings
+
+
+def count_primitives(artist):
+    # vertices of lines, paths or offsets of collections, patches are one
+    if hasattr(artist, 'get_xydata'):
+        return len(artist.get_xydata())
+    if hasattr(artist, 'get_offsets'):
+        return max(len(artist.get_paths()), len(artist.get_offsets()))
+    return 1
+
+
+def rasterize_dense(fig, cfg):
+    # The lines, collections or patches of an axes whose primitives add up to
+    # more than rasterize_threshold are drawn as one image at rasterize_dpi in
+    # vector outputs; axes, texts and legends stay vector.
+    if not cfg.rasterize_threshold:
+        return
+    for ax in fig.axes:
+        for group in (ax.lines, ax.collections, ax.patches):
+            if sum(count_primitives(a) for a in group) > cfg.rasterize_threshold:
+                for a in group:
+                    a.set_rasterized(True)
+
+
+def layout_chart(fig, cfg):
+    # Lay the figure out once, then detach the layout engine: savefig would
+    # otherwise measure every artist again in an extra draw before each output.
+    # The crop box and all outputs reuse this layout. Labels are placed last,
+    # against the final axes positions.
+    if cfg.layout_engine == 'tight':
+        fig.tight_layout()
+    elif cfg.layout_engine == 'constrained':
+        # axes moved by the builders (set_position) are laid out all the same
+        for ax in fig.axes:
+            ax.set_in_layout(True)
+        if hasattr(fig, 'set_layout_engine'):
+            fig.set_layout_engine('constrained')
+            fig.get_layout_engine().execute(fig)
+        else:
+            fig.set_constrained_layout(True)
+            fig.execute_constrained_layout()
+            fig.set_constrained_layout(False)
+    elif cfg.layout_engine is not None:
+        raise ValueError("Unknown layout_engine: %s" % cfg.layout_engine)
+    if hasattr(fig, 'set_layout_engine'):
+        fig.set_layout_engine(None)
+    place_pending_labels(fig)
 
-            filename = '%s/%s%s' % (root, fname, fext)
-
-            # csv2rec will lower case the headers, spaces will be converted to underscores, and illegal attribute name characters removed.
-            # this is a workaround
-            with open(filename, 'r') as f_input:
-                 headers = next(csv.reader(f_input))
-
-            # Read csv file, returns a recarray
-            print("Updating the figure %s/%s.pdf" % (root, fname))
-            ra = mp.mlab.csv2rec('%s/%s%s' % (root, fname, fext), names=headers, skiprows=1)
-
-            if chart_type == "barchart":
-                # call the plotting function
-                plt,leg = mk_barchart(title=fname if title == "from-filename" else title,
-                                    ra=ra)
-
-            elif chart_type == "clusterstacked":
-                # call the plotting function
-                plt,leg = mk_clusterstacked(title=fname if title == "from-filename" else title,
-                                    ra=ra)
-
-            elif chart_type == "stacked":
-                # call the plotting function
-                plt,leg = mk_stacked()
-
-            elif chart_type == "linechart":
-                # call the plotting function
-                plt,leg = mk_linechart(title=fname if title == "from-filename" else title,
-                                    ra=ra)
-
-            elif chart_type == "roofline":
-                # Open the file that contains the ceilings
-                filename_ceilings = '%s/%s.cei' % (root, fname)
-                with open(filename_ceilings, 'rb') as f:
-                    reader = csv.reader(f)
-                    ceilings = list(reader)
-                for row in [1,3]:
-                    for i in range(len(ceilings[row])):
-                        ceilings[row][i] = float(ceilings[row][i])
-
-                # call the plotting function
-                plt,leg = mk_roofline(title=fname if title == "from-filename" else title,
-                                    ceilings=ceilings, ra=ra)
 
-            else:
-                print("Wrong chart type")
-                exit(1)
+def save_chart(fig, leg, files, cfg):
+    bbox = get_crop_box(fig, [leg], cfg.crop_pad_inches)
+    for path, fmt, dpi in files:
+        # the dpi of vector formats only applies to their rasterized layers
+        if dpi is None and cfg.rasterize_threshold and fmt in ('pdf', 'svg', 'eps', 'ps'):
+            dpi = cfg.rasterize_dpi
+        fig.savefig(path, format=fmt, dpi=dpi, bbox_inches=bbox)
+
+
+def build_chart(fname, ds, ceilings, cfg, ax=None):
+    # draw the chart of a data file on a new figure, or on ax for a panel of a grid
+    title = fname if cfg.title == "from-filename" else cfg.title
+
+    if cfg.chart_type == "barchart":
+        # call the plotting function
+        fig,leg = mk_barchart(title=title, ds=ds, cfg=cfg, ax=ax)
+
+    elif cfg.chart_type == "clusterstacked":
+        # call the plotting function
+        fig,leg = mk_clusterstacked(title=title, ds=ds, cfg=cfg, ax=ax)
+
+    elif cfg.chart_type == "stacked":
+        # call the plotting function
+        fig,leg = mk_stacked()
+
+    elif cfg.chart_type == "linechart":
+        # call the plotting function
+        fig,leg = mk_linechart(title=title, ds=ds, cfg=cfg, ax=ax)
+
+    elif cfg.chart_type == "roofline":
+        # call the plotting function
+        fig,leg = mk_roofline(title=title, ceilings=ceilings, ds=ds, cfg=cfg, ax=ax)
+
+    else:
+        raise ValueError("Wrong chart type: %s" % cfg.chart_type)
+
+    if ax is None:
+        rasterize_dense(fig, cfg)
+    return fig, leg
+
+
+def grid_shape(cfg, panels):
+    # (rows, cols) of a grid, a dimension given as None fits all the panels
+    rows, cols = cfg.grid
+    if rows is None and cols is None:
+        cols = int(np.ceil(np.sqrt(panels)))
+    if rows is None:
+        rows = -(-panels // cols)
+    elif cols is None:
+        cols = -(-panels // rows)
+    if rows * cols < panels:
+        raise ValueError("A grid of %dx%d can not hold %d panels" % (rows, cols, panels))
+    return rows, cols
+
+
+def build_grid(panels, cfg):
+    # One figure with a panel per data file, in file name order, each drawn by
+    # the builder of chart_type on its own axes. Shared axes keep tick labels on
+    # the outer panels only; a shared legend is taken from the first panel and
+    # put above the grid.
+    rows, cols = grid_shape(cfg, len(panels))
+    fig = new_figure(cfg)
+    axes = []
+    legends = []
+    for k, (fname, ds, ceilings) in enumerate(panels):
+        ax = fig.add_subplot(rows, cols, k+1,
+                             sharex=axes[0] if axes and cfg.grid_sharex else None,
+                             sharey=axes[0] if axes and cfg.grid_sharey else None)
+        fig, leg = build_chart(fname, ds, ceilings, cfg, ax=ax)
+        axes.append(ax)
+        legends.append(leg)
+
+    for k, ax in enumerate(axes):
+        if cfg.grid_sharex and k + cols < len(axes): # a panel below
+            ax.tick_params(axis='x', labelbottom=False)
+            ax.set_xlabel('')
+        if cfg.grid_sharey and k % cols:
+            ax.tick_params(axis='y', labelleft=False)
+            ax.set_ylabel('')
+
+    leg = None
+    if cfg.grid_legend == 'each':
+        leg = legends[0]
+    elif cfg.grid_legend == 'shared' and legends[0].get_texts():
+        handles = getattr(legends[0], 'legend_handles', None) or legends[0].legendHandles
+        labels = [t.get_text() for t in legends[0].get_texts()]
+        leg = fig.legend(handles, labels, loc='lower center', bbox_to_anchor=(0.5, 1.),
+                         ncol=cfg.legend_ncol, frameon=True, fancybox=True,
+                         fontsize=cfg.legend_fontsize)
+    if cfg.grid_legend != 'each':
+        for l in legends:
+            l.remove()
+    if leg is None:
+        leg = fig.legend([], [], frameon=False)
+
+    rasterize_dense(fig, cfg)
+    return fig, leg
+
+
+def data_files(fname, fext):
+    # (name, extension) of the data files of a figure, those of its panels for a grid
+    if isinstance(fext, tuple):
+        return list(fext)
+    return [(fname, fext)]
+
+
+def load_figure(root, fname, fext, cfg):
+    # [(name, data, ceilings)] of every data file drawn in a figure
+    return [(name,) + load_chart(root, name, ext, cfg) for name, ext in data_files(fname, fext)]
+
+
+def build_figure(panels, cfg):
+    if cfg.grid:
+        return build_grid(panels, cfg)
+    fname, ds, ceilings = panels[0]
+    return build_chart(fname, ds, ceilings, cfg)
+
+
+# matplotlib's own LaTeX cache folder, restored for folders without tex_cache_dir
+_default_tex_cache = []
+
+def set_tex_cache(cfg):
+    # With usetex every text is typeset by LaTeX once and the result is kept by
+    # matplotlib in a cache folder; tex_cache_dir points it at a folder that can
+    # be shared by all workers and kept across runs and machines.
+    if not cfg.tex_cache_dir and not _default_tex_cache:
+        return
+    from matplotlib.texmanager import TexManager
+    # the folder is _cache_dir since matplotlib 3.5, texcache before
+    attr = '_cache_dir' if hasattr(TexManager, '_cache_dir') else 'texcache'
+    if not _default_tex_cache:
+        _default_tex_cache.append(getattr(TexManager, attr))
+    if cfg.tex_cache_dir:
+        path = os.path.abspath(os.path.expanduser(cfg.tex_cache_dir))
+        try:
+            os.makedirs(path)
+        except OSError: # already there, or created by another worker
+            pass
+        setattr(TexManager, attr, type(_default_tex_cache[0])(path))
+    else:
+        setattr(TexManager, attr, _default_tex_cache[0])
+
+
+def collect_tex_strings(job):
+    # Build a figure with placeholder text metrics and record every
+    # (string, fontsize) matplotlib asks LaTeX to measure, without running LaTeX.
+    # Figures are not saved, tick labels and legends are laid out through
+    # get_tightbbox. Returns the job and the strings, empty without usetex.
+    root, fname, fext, configs = job
+    cfg = resolve_config(root)
+    strings = set()
+    with mp.rc_context():
+        mp.rc_file_defaults()
+        mp.rcParams.update(cfg.rc)
+        if not mp.rcParams['text.usetex']:
+            return job, []
+
+        from matplotlib.texmanager import TexManager
+        def record(tex, fontsize, renderer=None):
+            strings.add((tex, fontsize))
+            return 0.5*fontsize*len(tex), fontsize, 0.2*fontsize
+
+        measure = TexManager.__dict__['get_text_width_height_descent']
+        TexManager.get_text_width_height_descent = staticmethod(record)
+        try:
+            fig, leg = build_figure(load_figure(root, fname, fext, cfg), cfg)
+            try:
+                layout_chart(fig, cfg)
+                fig.get_tightbbox(get_renderer(fig))
+            finally:
+                release_figure(fig)
+        except Exception:
+            pass # reported by the actual rendering
+        finally:
+            TexManager.get_text_width_height_descent = measure
+            # placeholder metrics are cached with the renderer they were
+            # measured with, so the figures are not reused for real renders
+            _figures.clear()
+            from matplotlib.text import Text
+            if hasattr(Text, '_cached'):
+                Text._cached.clear()
+    return job, sorted(strings)
+
+
+def typeset_tex_strings(strings):
+    # run LaTeX on a single (string, fontsize), errors are left to the rendering
+    from matplotlib.texmanager import TexManager
+    try:
+        TexManager().make_dvi(*strings)
+    except Exception:
+        pass
 
-            #plt.show()
-            plt.savefig("%s/%s.pdf" % (root, fname),bbox_extra_artists=(leg,), bbox_inches='tight')
+
+def preflight_tex(chart_jobs, jobs=1, pool=None):
+    # Fill the LaTeX cache before rendering: the strings of all figures are
+    # collected first, then every distinct one is typeset once, N LaTeX
+    # processes at a time, so that rendering itself only reads the cache.
+    if pool is not None:
+        collected = list(pool.imap_unordered(collect_tex_strings, chart_jobs))
+    else:
+        collected = [collect_tex_strings(job) for job in chart_jobs]
+
+    # folders sharing their configuration files share preamble and fonts,
+    # which are part of what LaTeX typesets
+    groups = {}
+    for job, strings in collected:
+        root, fname, fext, configs = job
+        groups.setdefault(tuple(configs), (root, set()))[1].update(strings)
+
+    from multiprocessing.pool import ThreadPool
+    threads = ThreadPool(jobs)
+    try:
+        for configs, (root, strings) in sorted(groups.items()):
+            if not strings:
+                continue
+            cfg = resolve_config(root)
+            with mp.rc_context():
+                mp.rc_file_defaults()
+                mp.rcParams.update(cfg.rc)
+                set_tex_cache(cfg)
+                start = time.time()
+                threads.map(typeset_tex_strings, sorted(strings))
+            print("Typeset %d strings for %s in %.2fs" % (len(strings), root, time.time() - start))
+    finally:
+        threads.close()
+        threads.join()
+
+
+def get_output_paths(job):
+    root, fname, fext, configs = job
+    return [path for path, fmt, dpi in output_files(root, fname, resolve_config(root))]
+
+
+# content hashes by path, with the (mtime, size) they were computed at
+_file_hashes = {}
+def file_hash(path):
+    # content hash of a file, computed again only when the file is touched
+    st = os.stat(path)
+    cached = _file_hashes.get(path)
+    if cached is None or cached[0] != (st.st_mtime, st.st_size):
+        h = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                h.update(block)
+        cached = ((st.st_mtime, st.st_size), h.hexdigest())
+        _file_hashes[path] = cached
+    return cached[1]
+
+
+def job_digest(job):
+    # hash over everything a figure depends on: data, roofline ceilings,
+    # default and local configs, and the paperplot version and code itself
+    root, fname, fext, configs = job
+    inputs = []
+    for name, ext in data_files(fname, fext):
+        inputs.append('%s/%s%s' % (root, name, ext))
+        filename_ceilings = '%s/%s.cei' % (root, name)
+        if os.path.isfile(filename_ceilings):
+            inputs.append(filename_ceilings)
+    inputs.append(DEFAULT_CONFIG)
+    inputs.extend(configs)
+    inputs.append(SCRIPT)
+
+    h = hashlib.sha1(__version__.encode('utf-8'))
+    for path in inputs:
+        h.update(('%s:%s\n' % (os.path.basename(path), file_hash(path))).encode('utf-8'))
+    return h.hexdigest()
+
+
+def load_manifest(basedir):
+    try:
+        with open(os.path.join(basedir, MANIFEST_FNAME), 'r') as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+
+
+def save_manifest(basedir, manifest):
+    # write to a temporary file first so an interrupted run never leaves a broken manifest
+    path = os.path.join(basedir, MANIFEST_FNAME)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.rename(path + '.tmp', path)
+
+
+def run_chart(job, timings=False, profile_dir=None):
+    # Render one job, reporting failures instead of aborting the whole run.
+    # Returns the job, the error (or None) and the seconds per stage (None
+    # without timings). With profile_dir a cProfile file is written per figure.
+    global _stage_times
+    _stage_times = {} if timings else None
+    del _open_stages[:]
+    profiler = None
+    if profile_dir:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    start = time.time()
+    try:
+        render_chart(job)
+        error = None
+    except Exception:
+        error = traceback.format_exc()
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            root, fname, fext, configs = job
+            name = os.path.normpath(os.path.join(root, fname)).strip(os.sep).replace(os.sep, '_')
+            profiler.dump_stats(os.path.join(profile_dir, name + '.prof'))
+    times, _stage_times = _stage_times, None
+    if times is not None:
+        times['total'] = time.time() - start
+    return job, error, times
+
+
+def print_timings(results, top=10):
+    # the slowest figures with the time of every stage and their number of
+    # draws, then the time of every stage over all figures
+    results = [(times['total'], job, times) for job, error, times in results if times]
+    if not results:
+        return
+    width = max(len(job_name(job)) for total, job, times in results)
+    print("\nSlowest figures (s):")
+    print("  %-*s %7s %s %5s" % (width, 'figure', 'total', ' '.join('%7s' % s for s in STAGES), 'draws'))
+    for total, job, times in sorted(results, key=lambda r: -r[0])[:top]:
+        print("  %-*s %7.3f %s %5d" % (width, job_name(job), total,
+              ' '.join('%7.3f' % times.get(s, 0.) for s in STAGES), times.get('draws', 0)))
+    total = sum(r[0] for r in results)
+    print("Stages over %d figures: %s" % (len(results), ', '.join(
+          '%s %.2fs (%d%%)' % (s, sum(r[2].get(s, 0.) for r in results),
+                               100 * sum(r[2].get(s, 0.) for r in results) / total if total else 0)
+          for s in STAGES)))
+    print("Draws per figure: %.1f" % (sum(r[2].get('draws', 0) for r in results) / float(len(results))))
+
+
+def init_worker():
+    # every worker process starts from clean matplotlib settings
+    mp.rcdefaults()
+
+
+def mk_charts(basedir, jobs=1, force=False, pool=None, tex_preflight=False,
+              timings=False, profile_dir=None):
+    start = time.time()
+    manifest = load_manifest(basedir)
+
+    # only figures whose inputs changed since the last run (or whose output is gone) are rendered;
+    # folders with a broken configuration and figures that can not be planned are reported as failed
+    chart_jobs = []
+    digests = {}
+    uptodate = 0
+    errors = []
+    for job in plan_charts(basedir, errors):
+        try:
+            digests[job[:2]] = job_digest(job)
+            outputs = get_output_paths(job)
+        except Exception:
+            errors.append((job_name(job), traceback.format_exc()))
+            continue
+        if not force and all(manifest.get(os.path.relpath(output, basedir)) == digests[job[:2]] and os.path.isfile(output)
+                             for output in outputs):
+            uptodate += 1
+        else:
+            chart_jobs.append(job)
+
+    planned = time.time() - start
+    own_pool = pool is None and jobs > 1 and len(chart_jobs) > 1
+    if own_pool:
+        pool = multiprocessing.Pool(processes=min(jobs, len(chart_jobs)), initializer=init_worker)
+    try:
+        if tex_preflight and chart_jobs:
+            preflight_tex(chart_jobs, jobs, pool if len(chart_jobs) > 1 else None)
+
+        if profile_dir and not os.path.isdir(profile_dir):
+            os.makedirs(profile_dir)
+        run = functools.partial(run_chart, timings=timings, profile_dir=profile_dir)
+        if pool is None or len(chart_jobs) < 2:
+            results = [run(job) for job in chart_jobs]
+        else:
+            results = list(pool.imap_unordered(run, chart_jobs))
+    finally:
+        if own_pool:
+            pool.close()
+            pool.join()
+
+    # per job summary
+    failed = 0
+    for name, error in errors:
+        failed += 1
+        print("FAILED %s\n%s" % (name, error))
+    for job, error, times in sorted(results, key=lambda r: r[0][:2]):
+        outputs = get_output_paths(job)
+        for output in outputs:
+            if error:
+                manifest.pop(os.path.relpath(output, basedir), None)
+            else:
+                manifest[os.path.relpath(output, basedir)] = digests[job[:2]]
+        if error:
+            failed += 1
+            print("FAILED %s\n%s" % (job_name(job), error))
+        else:
+            print("OK     %s" % ' '.join(outputs))
+    print("%d figures rendered, %d up to date, %d failed" % (len(results) + len(errors) - failed, uptodate, failed))
+    if timings:
+        print_timings(results)
+        print("Planning %.2fs, total %.2fs" % (planned, time.time() - start))
+
+    if results:
+        save_manifest(basedir, manifest)
+    return failed
+
+
+# steps of the --convert pipeline in dependency order: source extension,
+# converted extension and the convert_tools entry running the conversion
+CONVERT_STEPS = (('.dia', '.eps', 'dia'),
+                 ('.svg', '.pdf', 'svg'),
+                 ('.eps', '.pdf', 'eps'),
+                 ('.pdf', '-crop.pdf', 'pdf'))
+
+def plan_conversions(basedir, errors=None):
+    # Walk basedir once and list every conversion as (tool, source, output,
+    # command). Outputs of a step are planned as sources of the later steps, so
+    # e.g. a .dia file is exported to .eps, then converted to .pdf and cropped.
+    # Files of paperplot figures (with a data file of the same name next to
+    # them, or grids) are its own outputs and never converted. When two sources
+    # would be converted into the same file (e.g. a.svg and a.eps), only the
+    # first step runs. With a list as errors, folders whose configuration fails
+    # are added to it as (folder, traceback) and skipped with their subfolders,
+    # and files without a convert_tools entry as (file, message), instead of
+    # raising.
+    files, commands, figures = [], {}, set()
+    for root, dirs, fs in os.walk(basedir):
+        try:
+            cfg = resolve_config(root)
+        except Exception:
+            if errors is None:
+                raise
+            errors.append((root, traceback.format_exc()))
+            dirs[:] = []
+            continue
+        commands[root] = cfg.convert_tools
+        if cfg.grid:
+            figures.add(os.path.join(root, grid_name(root, cfg)))
+        for f in sorted(fs):
+            fname, fext = split_data_name(f, cfg.EXTENSIONS)
+            if fext is not None:
+                figures.add(os.path.join(root, fname))
+            files.append((root, f))
+    present = set(os.path.join(root, f) for root, f in files)
+
+    conversions = []
+    outputs = set()
+    for src, dst, tool in CONVERT_STEPS:
+        for root, f in list(files):
+            path = os.path.join(root, f)
+            if not f.lower().endswith(src) or f.lower().endswith('-crop.pdf'):
+                continue
+            if path[:-len(src)] in figures:
+                continue
+            output = path[:-len(src)] + dst
+            if output in outputs:
+                print("Not converting %s, %s is converted from another file" % (path, output))
+                continue
+            if tool not in commands[root]:
+                message = "convert_tools of %s has no '%s' entry" % (root, tool)
+                if errors is None:
+                    raise ValueError(message)
+                errors.append((path, message))
+                continue
+            outputs.add(output)
+            conversions.append((tool, path, output, commands[root][tool]))
+            if output not in present:
+                present.add(output)
+                files.append((root, os.path.basename(output)))
+    return conversions
+
+
+def conversion_digest(conversion):
+    # a converted file is up to date while both its source and the command are unchanged
+    tool, source, output, command = conversion
+    h = hashlib.sha1(('%s\n%s\n' % (tool, ' '.join(command))).encode('utf-8'))
+    h.update(file_hash(source).encode('utf-8'))
+    return h.hexdigest()
+
+
+def convert_file(conversion):
+    # run one external conversion, returns the conversion, the error (or None) and the time it took
+    tool, source, output, command = conversion
+    start = time.time()
+    try:
+        p = subprocess.Popen([arg.format(input=source, output=output) for arg in command],
+                             stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        out = p.communicate()[0].decode('utf-8', 'replace')
+    except OSError as e:
+        return conversion, "%s: %s" % (command[0], e), time.time() - start
+    if p.returncode or not os.path.isfile(output):
+        return conversion, out or "%s exited with status %d" % (command[0], p.returncode), time.time() - start
+    return conversion, None, time.time() - start
+
+
+def mk_conversions(basedir, jobs=1, force=False):
+    # Convert the figure assets of basedir (see CONVERT_STEPS), one step after
+    # the other and the files of a step in parallel. Conversions are skipped
+    # when the content of their source did not change since the last run.
+    from multiprocessing.pool import ThreadPool
+    manifest = load_manifest(basedir)
+    # folders with a broken configuration and files without a tool are reported as failed
+    errors = []
+    conversions = plan_conversions(basedir, errors)
+    for name, error in errors:
+        print("FAILED %s\n%s" % (name, error))
+    failed_outputs = set()
+    threads = ThreadPool(jobs)
+    try:
+        for src, dst, tool in CONVERT_STEPS:
+            step = [c for c in conversions if c[0] == tool]
+            if not step:
+                continue
+            start = time.time()
+            todo, digests, uptodate, skipped = [], {}, 0, 0
+            for conversion in step:
+                source, output = conversion[1], conversion[2]
+                # the source could not be produced by an earlier step
+                if source in failed_outputs or not os.path.isfile(source):
+                    failed_outputs.add(output)
+                    skipped += 1
+                    continue
+                digests[output] = conversion_digest(conversion)
+                if not force and manifest.get(os.path.relpath(output, basedir)) == digests[output] and os.path.isfile(output):
+                    uptodate += 1
+                else:
+                    todo.append(conversion)
+
+            failed = 0
+            for conversion, error, elapsed in sorted(threads.map(convert_file, todo)):
+                source, output = conversion[1], conversion[2]
+                if error:
+                    failed += 1
+                    failed_outputs.add(output)
+                    manifest.pop(os.path.relpath(output, basedir), None)
+                    print("FAILED %s -> %s\n%s" % (source, output, error))
+                else:
+                    manifest[os.path.relpath(output, basedir)] = digests[output]
+                    print("OK     %s -> %s (%.2fs)" % (source, output, elapsed))
+            print("%s -> %s: %d converted, %d up to date, %d failed, %d skipped in %.2fs" %
+                  (src, dst, len(todo) - failed, uptodate, failed, skipped, time.time() - start))
+    finally:
+        threads.close()
+        threads.join()
+
+    save_manifest(basedir, manifest)
+    return len(failed_outputs) + len(errors)
+
+
+def snapshot_inputs(basedir):
+    # (mtime, size) of every file a figure of basedir can depend on
+    st = os.stat(DEFAULT_CONFIG)
+    snapshot = {DEFAULT_CONFIG : (st.st_mtime, st.st_size)}
+    for root, dirs, files in os.walk(basedir):
+        try:
+            cfg = resolve_config(root)
+        except Exception:
+            # a broken configuration file is reported by the next build
+            cfg = resolve_default_config()
+        for f in files:
+            if (split_data_name(f, cfg.EXTENSIONS)[1] or f.endswith('.cei') or
+                f == cfg.config_fname):
+                path = os.path.join(root, f)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                snapshot[path] = (st.st_mtime, st.st_size)
+    return snapshot
+
+
+def watch_charts(basedir, jobs=1, interval=0.5, **options):
+    # Long-lived rebuild loop: matplotlib, the compiled configs and the parse
+    # cache stay loaded, and the tree is polled for changes to CSV, .cei and
+    # configuration files. Every change runs an incremental build, so only the
+    # figures whose inputs changed are rendered (a configuration file is an
+    # input of every figure below it).
+    pool = None
+    if jobs > 1:
+        pool = multiprocessing.Pool(processes=jobs, initializer=init_worker)
+    try:
+        snapshot = None
+        while True:
+            current = snapshot_inputs(basedir)
+            if current != snapshot:
+                # wait for editors that write a file in several steps
+                time.sleep(interval / 2.)
+                settled = snapshot_inputs(basedir)
+                if settled != current:
+                    continue
+                snapshot = current
+                start = time.time()
+                try:
+                    mk_charts(basedir, jobs=jobs, pool=pool, **options)
+                except Exception:
+                    traceback.print_exc()
+                print("Built in %.2fs, watching %s for changes (Ctrl-C to stop)" % (time.time() - start, basedir))
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
 
 
 if __name__ == "__main__":
 
-    if len(sys.argv) != 2:
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument('-h', '--help', action='store_true')
+    parser.add_argument('-j', '--jobs', type=int, default=1)
+    parser.add_argument('-f', '--force', action='store_true')
+    parser.add_argument('-w', '--watch', action='store_true')
+    parser.add_argument('--watch-interval', type=float, default=0.5)
+    parser.add_argument('--tex-preflight', action='store_true')
+    parser.add_argument('--convert', action='store_true')
+    parser.add_argument('--timings', action='store_true')
+    parser.add_argument('--profile', metavar='DIR')
+    parser.add_argument('basedir', nargs='?')
+    args, unknown = parser.parse_known_args()
+
+    if args.help or args.basedir is None or unknown or args.jobs < 0 or args.watch_interval <= 0:
         print_usage(__file__)
         exit(1)
 
-    if os.path.isdir(sys.argv[1]):
-        mk_charts(sys.argv[1]) # will go into subfolders
+    if os.path.isdir(args.basedir):
+        # --jobs 0 uses one worker per core
+        jobs = args.jobs or multiprocessing.cpu_count()
+        if args.convert:
+            exit(1 if mk_conversions(args.basedir, jobs=jobs, force=args.force) else 0)
+        options = dict(timings=args.timings, profile_dir=args.profile)
+        if args.watch:
+            if args.force or args.tex_preflight:
+                mk_charts(args.basedir, jobs=jobs, force=args.force, tex_preflight=args.tex_preflight, **options)
+            watch_charts(args.basedir, jobs=jobs, interval=args.watch_interval, **options)
+            exit(0)
+        # will go into subfolders
+        failed = mk_charts(args.basedir, jobs=jobs, force=args.force,
+                           tex_preflight=args.tex_preflight, **options)
+        exit(1 if failed else 0)
     else:
-        print('ERROR: Invalid path provided: ' + sys.argv[1])
+        print('ERROR: Invalid path provided: ' + args.basedir)
         print_usage(__file__)
         exit(1)
@@ -0,0 +1,19 @@
+# Tests of the decimation of long line chart series, run with: python -m pytest tests
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import paperplot as pp
+
+
+def test_downsampling_to_fewer_than_three_points():
+    # e.g. downsample_points * figure width below 3
+    x = np.arange(1000.)
+    y = np.sin(x)
+    for how in ('lttb', 'minmax'):
+        for points in (0, 1, 2):
+            keep = pp.downsample(x, y, points, how)
+            assert keep[0] == 0 and keep[-1] == len(x) - 1
+            assert 3 <= len(keep) <= 4
@@ -0,0 +1,24 @@
+# Tests of the figures handed out to the chart builders, run with: python -m pytest tests
+import os
+import sys
+
+import matplotlib as mp
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import paperplot as pp
+
+
+class Config(object):
+    figure_size = (5, 4)
+    reuse_figures = True
+
+
+def test_reused_figures_keep_the_rc_settings_of_their_folder():
+    figures = {}
+    for dpi in (50, 100, 50):
+        with mp.rc_context({'figure.dpi' : dpi}):
+            fig = pp.new_figure(Config())
+            assert fig.dpi == dpi
+            assert figures.setdefault(dpi, fig) is fig
+            pp.release_figure(fig)
+    pp._figures.clear()
@@ -0,0 +1,83 @@
+# Regression tests of the label placement, run with: python -m pytest tests
+import os
+import shutil
+import sys
+
+import matplotlib as mp
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import paperplot as pp
+
+EXAMPLES = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'examples')
+
+
+def laid_out_chart(root, fname):
+    # figure of a data file after layout, drawn without LaTeX
+    cfg = pp.resolve_config(root)
+    with mp.rc_context():
+        mp.rc_file_defaults()
+        mp.rcParams.update(cfg.rc)
+        mp.rcParams['text.usetex'] = False
+        ds, ceilings = pp.load_chart(root, fname, '.csv', cfg)
+        fig, leg = pp.build_chart(fname, ds, ceilings, cfg)
+        pp.layout_chart(fig, cfg)
+        return fig
+
+
+def overlapping_labels(fig):
+    renderer = pp.get_renderer(fig)
+    pairs = []
+    for ax in fig.axes:
+        texts = [t for t in ax.texts if t.get_text()]
+        extents = [t.get_window_extent(renderer) for t in texts]
+        for i in range(len(texts)):
+            for j in range(i + 1, len(texts)):
+                if extents[i].overlaps(extents[j]):
+                    pairs.append((texts[i].get_text(), texts[j].get_text()))
+    return pairs
+
+
+def test_linechart_labels_do_not_overlap():
+    fig = laid_out_chart(os.path.join(EXAMPLES, 'linechart', 'multiline'), 'multiline')
+    try:
+        assert len(fig.axes[0].texts) == 12
+        assert overlapping_labels(fig) == []
+    finally:
+        pp.release_figure(fig)
+
+
+def test_labels_are_placed_in_the_final_view():
+    # labels stay next to their points once the limits are autoscaled
+    fig = laid_out_chart(os.path.join(EXAMPLES, 'linechart', 'multiline'), 'multiline')
+    try:
+        ax = fig.axes[0]
+        (x0, x1), (y0, y1) = ax.get_xlim(), ax.get_ylim()
+        for t in ax.texts:
+            x, y = t.get_position()
+            assert x0 <= x <= x1 and y0 <= y <= y1
+    finally:
+        pp.release_figure(fig)
+
+
+def test_roofline_labels_follow_their_ceilings(tmp_path):
+    # the memory ceiling labels are drawn at the angle of their line on
+    # screen, also when the y limits are autoscaled
+    root = str(tmp_path)
+    shutil.copytree(os.path.join(EXAMPLES, 'roofline'), root, dirs_exist_ok=True)
+    with open(os.path.join(root, 'local.config.py'), 'a') as f:
+        f.write('ylim = None\n')
+    fig = laid_out_chart(root, 'test_all_hbm')
+    try:
+        ax = fig.axes[0]
+        renderer = pp.get_renderer(fig)
+        ceilings = [line for line in ax.lines if len(line.get_xydata()) == 3]
+        labels = [t for t in ax.texts if t.get_transform_rotates_text()]
+        assert ceilings and len(labels) == len(ceilings)
+        for line, text in zip(ceilings, labels):
+            p0, p1 = ax.transData.transform(line.get_xydata()[:2])
+            angle = np.degrees(np.arctan2(p1[1] - p0[1], p1[0] - p0[0]))
+            text.draw(renderer)
+            assert abs(text.get_rotation() - angle) < 0.5
+    finally:
+        pp.release_figure(fig)
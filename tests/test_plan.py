@@ -0,0 +1,37 @@
+# Tests of the planning of figures, run with: python -m pytest tests
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import paperplot as pp
+
+
+def test_data_files_drawing_the_same_figure_are_reported(tmp_path):
+    for name in ('x.csv', 'x.csv.gz', 'y.csv'):
+        (tmp_path / name).write_text('')
+    root = str(tmp_path)
+    errors = []
+    jobs = pp.plan_charts(root, errors)
+    assert [job[1:3] for job in jobs] == [('y', '.csv')]
+    assert [name for name, message in errors] == ['%s/x' % root]
+    with pytest.raises(ValueError, match='x.csv, x.csv.gz all draw the figure'):
+        pp.plan_charts(root)
+
+
+def test_conversion_failures_are_reported_per_folder(tmp_path):
+    # a broken configuration skips its folder, a missing tool the file it converts
+    for folder, config in (('a', 'raise ValueError\n'),
+                           ('b', "convert_tools = {'svg' : ['cp', '{input}', '{output}']}\n"),
+                           ('c', '')):
+        (tmp_path / folder).mkdir()
+        (tmp_path / folder / 'local.config.py').write_text(config)
+        (tmp_path / folder / 'f.pdf').write_text('')
+    root = str(tmp_path)
+    errors = []
+    conversions = pp.plan_conversions(root, errors)
+    assert [c[1] for c in conversions] == [os.path.join(root, 'c', 'f.pdf')]
+    assert [name for name, message in errors] == [os.path.join(root, 'a'), os.path.join(root, 'b', 'f.pdf')]
+    with pytest.raises(ValueError):
+        pp.plan_conversions(root)
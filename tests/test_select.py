@@ -0,0 +1,36 @@
+# Tests of the row and column selection of data files, run with: python -m pytest tests
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import paperplot as pp
+
+
+def dataset():
+    return pp.Dataset(['bench', 'label', 'S1', 'S2'],
+                      [np.array(['bt', 'sp', 'lu']), np.array(['a', 'b', 'c']),
+                       np.array([3., 1., 2.]), np.array([1., 3., 2.])])
+
+
+def test_colfilters_by_position_keep_the_header_names():
+    ds = pp.select_results(dataset(), colfilters=[0, 2, 3], sortby='S2')
+    assert ds.names == ['bench', 'S1', 'S2']
+    assert list(ds['bench']) == ['bt', 'lu', 'sp']
+
+
+def test_colfilters_by_name():
+    ds = pp.select_results(dataset(), colfilters=['bench', 'S1'])
+    assert ds.names == ['bench', 'S1']
+    assert list(ds[1]) == [3., 1., 2.]
+
+
+def test_short_rows_are_reported_with_rowfilters(tmp_path):
+    filename = str(tmp_path / 'short.csv')
+    with open(filename, 'w') as f:
+        f.write('bench,label,S1\nbt,a,1\nsp\n')
+    for rowfilters in (None, {'label' : ['a']}):
+        with pytest.raises(ValueError, match='Line 3 of .* has 1 fields, expected 3'):
+            pp.read_csv(filename, rowfilters)